@@ -1,27 +1,23 @@
 import streamlit as st
 import pandas as pd
-import gspread
-import json
-from google.oauth2.credentials import Credentials
+
+from utils.sheet_client import get_connection
+from utils.storage import get_storage
 
 st.set_page_config(page_title="ログイン画面", layout="centered")
 st.title("ログイン画面")
 
-# ✅ OAuth認証（分離＋例外処理）
+# ✅ OAuth認証（共通クライアントを使い回す）
 try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
+    get_connection()
 except Exception as e:
     st.error(f"Google Sheetsの認証に失敗しました: {e}")
     st.stop()
 
-# ✅ ユーザー情報取得（キャッシュ化）
-@st.cache_data(ttl=30)
+# ✅ ユーザー情報取得（全セッション共有のキャッシュから）
 def load_user_data():
     try:
-        sheet = gc.open(st.secrets["USER_SHEET_NAME"]).sheet1
-        records = sheet.get_all_records()
+        records = get_storage().user_records()
         return pd.DataFrame(records, dtype=str)
     except Exception as e:
         st.error(f"ユーザー情報の取得に失敗しました: {e}")
@@ -55,15 +51,9 @@ if st.session_state.get("logged_in"):
 
     # ✅ 商品シートから未支払い商品チェック
     try:
-        sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
-        all_products = sheet.get_all_records()
         user_id = str(st.session_state.get("id", "")).strip()
-        pending_items = [
-            row for row in all_products
-            if str(row.get("購入者", "")).strip() == user_id
-            and row.get("ステータス") == "購入手続き中"
-        ]
-        if pending_items:
+        pending_count = get_storage().count_by_buyer_status(user_id, "購入手続き中")
+        if pending_count:
             st.warning("⚠ 購入後、未支払いの商品があります。マイページ（購入）画面を確認してください。")
     except Exception as e:
         st.error(f"購入履歴の確認に失敗しました: {e}")
@@ -1,8 +1,8 @@
 import streamlit as st
-import gspread
-import json
-from google.oauth2.credentials import Credentials
-from datetime import datetime
+
+from utils.image_variants import image_tag
+from utils.search_index import ALL, SORT_OPTIONS, STATUS_OPTIONS, get_product_search
+from utils.storage import get_storage
 
 st.set_page_config(page_title="商品検索", layout="centered")
 
@@ -23,30 +23,16 @@ else:
         st.switch_page("app.py")
     st.stop()
 
-# 🔑 OAuth認証
-@st.cache_resource
-def get_gspread_client():
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    return gspread.authorize(creds)
-
-gc = get_gspread_client()
-
 # 📄 商品データ取得
 def load_product_data():
     try:
-        sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
-        raw_data = sheet.get_all_records()
-        return [
-            row for row in raw_data
-            if row.get("商品名") and row.get("価格") and row.get("画像URL")
-            and row.get("ステータス") != "取下げ"
-        ]
+        return get_product_search().refresh(get_storage())
     except Exception as e:
         st.error(f"商品データの取得に失敗しました: {e}")
-        return []
+        return None
 
-data = load_product_data()
+view = load_product_data()
+data = view.rows if view is not None else []
 if not data:
     st.stop()
 
@@ -108,22 +94,66 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# 🔍 絞り込み条件（件数表示のため、ウィジェットより先に前回の値から作る）
+category_options = [ALL] + view.categories["カテゴリ"]
+condition_options = [ALL] + view.categories["状態"]
+status_options = list(STATUS_OPTIONS)
+
+st.session_state.setdefault("search_text", "")
+st.session_state.setdefault("status_filter", "出品中のみ")
+# 商品データが変わって選択肢が無くなっていたら「すべて」に戻す
+if st.session_state.get("category_filter") not in category_options:
+    st.session_state["category_filter"] = ALL
+if st.session_state.get("condition_filter") not in condition_options:
+    st.session_state["condition_filter"] = ALL
+# 価格帯が今の最安値〜最高値からはみ出していたら解除する（全体なら絞り込まない）
+min_price, max_price = view.price_bounds()
+low, high = st.session_state.get("price_range", (min_price, max_price))
+if low < min_price or high > max_price:
+    st.session_state.pop("price_range")
+    low, high = min_price, max_price
+price_range = None if (low, high) == (min_price, max_price) else (low, high)
+
+filter_state = (
+    st.session_state["search_text"].strip(),
+    st.session_state["category_filter"],
+    st.session_state["condition_filter"],
+    st.session_state["status_filter"],
+    price_range,
+)
+search_ids = get_product_search().search(filter_state[0]) if filter_state[0] else None
+filters = view.filters(search_ids, *filter_state[1:4])
+facets = view.facets(filter_state, filters, price_range)
+
 # 🔍 絞り込み UI
 col1, col2, col3 = st.columns(3)
 with col1:
-    search = st.text_input("🔍 商品名で検索")
+    search = st.text_input("🔍 商品名・説明で検索", key="search_text")
 with col2:
-    category_filter = st.selectbox("📦 カテゴリ絞り込み", ["すべて"] + sorted(set(row.get("カテゴリ", "") for row in data)))
+    category_filter = st.selectbox(
+        "📦 カテゴリ絞り込み", category_options, key="category_filter",
+        format_func=lambda c: f"{c} ({facets['カテゴリ'][c]})",
+    )
 with col3:
-    condition_filter = st.selectbox("🧺 状態絞り込み", ["すべて"] + sorted(set(row.get("状態", "") for row in data)))
+    condition_filter = st.selectbox(
+        "🧺 状態絞り込み", condition_options, key="condition_filter",
+        format_func=lambda c: f"{c} ({facets['状態'][c]})",
+    )
 
 col4, col5, col6 = st.columns(3)
 with col4:
-    status_filter = st.selectbox("📌 出品ステータス", ["すべて", "出品中のみ", "売却済"], index=1)
+    status_filter = st.selectbox(
+        "📌 出品ステータス", status_options, key="status_filter",
+        format_func=lambda o: f"{o} ({facets['ステータス'][o]})",
+    )
 with col5:
-    sort_option = st.radio("並び順", ["新着順", "価格が安い順", "価格が高い順"], horizontal=True)
+    sort_option = st.radio("並び順", SORT_OPTIONS, horizontal=True)
 with col6:
-    st.empty()
+    if max_price > min_price:
+        st.slider(
+            "💴 価格帯", min_price, max_price, value=(min_price, max_price),
+            key="price_range", format="¥%d",
+        )
 
 # 🔄 ページリセット
 if "prev_filters" not in st.session_state:
@@ -134,6 +164,7 @@ current_filters = {
     "category": category_filter,
     "condition": condition_filter,
     "status": status_filter,
+    "price": price_range,
     "sort": sort_option
 }
 
@@ -141,32 +172,8 @@ if st.session_state["prev_filters"] != current_filters:
     st.session_state["page"] = 1
     st.session_state["prev_filters"] = current_filters
 
-# 🔎 絞り込み処理
-filtered = data
-if search:
-    filtered = [item for item in filtered if search.lower() in item.get("商品名", "").lower()]
-if category_filter != "すべて":
-    filtered = [item for item in filtered if item.get("カテゴリ") == category_filter]
-if condition_filter != "すべて":
-    filtered = [item for item in filtered if item.get("状態") == condition_filter]
-if status_filter == "出品中のみ":
-    filtered = [item for item in filtered if item.get("ステータス") == "出品中"]
-elif status_filter == "売却済":
-    filtered = [item for item in filtered if item.get("ステータス") not in ["出品中", "取下げ"]]
-
-# 🔢 並び替え
-def parse_datetime(dt_str):
-    try:
-        return datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
-    except:
-        return datetime.min
-
-if sort_option == "新着順":
-    filtered.sort(key=lambda x: parse_datetime(x.get("投稿日時", "")), reverse=True)
-elif sort_option == "価格が安い順":
-    filtered.sort(key=lambda x: x.get("価格", 0))
-elif sort_option == "価格が高い順":
-    filtered.sort(key=lambda x: x.get("価格", 0), reverse=True)
+# 🔎 絞り込み処理（並び替え済みの順序・価格帯の候補に条件を掛けて選ぶ）
+filtered = view.select(filters, sort_option, price_range)
 
 # 📄 ページネーション
 ITEMS_PER_PAGE = 12
@@ -197,7 +204,7 @@ render_pagination_controls("top")
 # 🖼️ 商品表示
 start_idx = (st.session_state["page"] - 1) * ITEMS_PER_PAGE
 end_idx = start_idx + ITEMS_PER_PAGE
-page_items = filtered[start_idx:end_idx]
+page_items = view.take(filtered[start_idx:end_idx])
 
 if page_items:
     for row_index in range(0, len(page_items), 3):
@@ -213,7 +220,7 @@ if page_items:
                 if image_url:
                     st.markdown(f"""
                         <div class="image-overlay">
-                            <img src="{image_url}" />
+                            {image_tag(image_url, "card")}
                             <div class="label condition">{condition}</div>
                             <div class="label price">¥{price}</div>
                         </div>
@@ -1,15 +1,14 @@
 import streamlit as st
-import gspread
-import json
-from PIL import Image, UnidentifiedImageError, ImageOps
 from datetime import datetime
-from google.oauth2.credentials import Credentials
-import io
 import uuid
 import pytz
 import time
 import cloudinary
-import cloudinary.uploader
+
+from utils.image_upload import upload_images
+from utils.image_variants import variant_url
+from utils.sheet_client import get_product_sheet
+from utils.storage import get_storage
 
 st.set_page_config(page_title="出品画面", layout="centered")
 st.title("出品画面")
@@ -45,10 +44,8 @@ edit_item = st.session_state.get("edit_product") if edit_mode else None
 # 🔑 OAuth認証
 # ============================================
 try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
-    sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
+    get_product_sheet()
+    storage = get_storage()
 except Exception as e:
     st.error(f"Google Sheetsの認証に失敗しました: {e}")
     st.stop()
@@ -115,11 +112,11 @@ st.session_state["desc"] = st.text_area("説明", st.session_state["desc"], key=
 # ============================================
 if edit_mode:
     st.markdown("### 現在の画像")
-    st.image(edit_item["画像URL"], width=200)
+    st.image(variant_url(edit_item["画像URL"], "gallery"), width=200)
     if edit_item.get("画像URLサブ1"):
-        st.image(edit_item["画像URLサブ1"], width=200)
+        st.image(variant_url(edit_item["画像URLサブ1"], "gallery"), width=200)
     if edit_item.get("画像URLサブ2"):
-        st.image(edit_item["画像URLサブ2"], width=200)
+        st.image(variant_url(edit_item["画像URLサブ2"], "gallery"), width=200)
 
 # ============================================
 # 🖼 新しい画像アップロード（文言変更済）
@@ -147,26 +144,30 @@ st.session_state["image_sub2"] = st.file_uploader(
 submit = st.button("保存する" if edit_mode else "出品する")
 
 # ============================================
-# ☁ 画像アップロード関数
+# ☁ 画像アップロード関数（3枚を並行してアップロード）
 # ============================================
-def process_and_upload(file):
-    try:
-        img = Image.open(file)
-        img = ImageOps.exif_transpose(img)
-    except UnidentifiedImageError:
-        return None
-
-    max_width = 512
-    if img.width > max_width:
-        ratio = max_width / img.width
-        img = img.resize((max_width, int(img.height * ratio)))
-
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-
-    result = cloudinary.uploader.upload(buf, folder="products")
-    return result["secure_url"]
+IMAGE_LABELS = {"image_main": "メイン画像", "image_sub1": "サブ画像1", "image_sub2": "サブ画像2"}
+
+def upload_selected_images():
+    files = {key: st.session_state[key] for key in IMAGE_LABELS}
+    if not any(files.values()):
+        return {}
+
+    progress = st.progress(0.0, text="画像をアップロードしています…")
+    urls, errors = upload_images(
+        files,
+        on_progress=lambda done, total: progress.progress(
+            done / total, text=f"画像をアップロードしています…（{done}/{total}）"
+        ),
+    )
+    progress.empty()
+
+    if errors:
+        # 1枚でも失敗したら保存しない（選んだ画像はそのまま残るので再実行できる）
+        for key, error in errors.items():
+            st.error(f"{IMAGE_LABELS[key]}のアップロードに失敗しました: {error}")
+        st.stop()
+    return urls
 
 # ============================================
 # 🚀 保存処理（編集モード or 新規出品）
@@ -182,26 +183,10 @@ if submit:
     # ----------------------------------------
     if edit_mode:
 
-        main_url = edit_item["画像URL"]
-        sub1_url = edit_item.get("画像URLサブ1", "")
-        sub2_url = edit_item.get("画像URLサブ2", "")
-
-        if st.session_state["image_main"]:
-            main_url = process_and_upload(st.session_state["image_main"])
-        if st.session_state["image_sub1"]:
-            sub1_url = process_and_upload(st.session_state["image_sub1"])
-        if st.session_state["image_sub2"]:
-            sub2_url = process_and_upload(st.session_state["image_sub2"])
-
-        all_data = sheet.get_all_records()
-        row_index = next((i for i, row in enumerate(all_data)
-                          if row.get("商品ID") == edit_item["商品ID"]), None)
-
-        if row_index is None:
-            st.error("商品が見つかりませんでした。")
-            st.stop()
-
-        row_num = row_index + 2
+        urls = upload_selected_images()
+        main_url = urls.get("image_main", edit_item["画像URL"])
+        sub1_url = urls.get("image_sub1", edit_item.get("画像URLサブ1", ""))
+        sub2_url = urls.get("image_sub2", edit_item.get("画像URLサブ2", ""))
 
         update_row = [
             edit_item["商品ID"], st.session_state["name"], st.session_state["price"],
@@ -213,7 +198,9 @@ if submit:
             edit_item.get("購入日時", ""), edit_item["ステータス"]
         ]
 
-        sheet.update(f"A{row_num}:P{row_num}", [update_row])
+        if not storage.update_product(edit_item["商品ID"], update_row, defer=True):
+            st.error("商品が見つかりませんでした。")
+            st.stop()
 
         st.success("商品情報を更新しました！")
         st.session_state.pop("edit_product")
@@ -228,9 +215,10 @@ if submit:
             st.warning("メイン画像は必須です。")
             st.stop()
 
-        main_url = process_and_upload(st.session_state["image_main"])
-        sub1_url = process_and_upload(st.session_state["image_sub1"]) if st.session_state["image_sub1"] else ""
-        sub2_url = process_and_upload(st.session_state["image_sub2"]) if st.session_state["image_sub2"] else ""
+        urls = upload_selected_images()
+        main_url = urls["image_main"]
+        sub1_url = urls.get("image_sub1", "")
+        sub2_url = urls.get("image_sub2", "")
 
         product_id = str(uuid.uuid4())
         jst = pytz.timezone("Asia/Tokyo")
@@ -245,7 +233,7 @@ if submit:
             "", "", "", "出品中"
         ]
 
-        sheet.append_row(new_row)
+        storage.append_product(new_row)
 
         # 完了メッセージを session_state に保存
         st.session_state["post_message"] = f"{st.session_state['username']} さん、商品を出品しました。ありがとうございます。"
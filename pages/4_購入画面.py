@@ -1,12 +1,12 @@
 import streamlit as st
-import gspread
-import json
 from PIL import Image, UnidentifiedImageError
 import io
 from datetime import datetime
-from google.oauth2.credentials import Credentials
 import pytz
-import time
+
+from utils.image_variants import image_tag
+from utils.sheet_client import get_product_sheet
+from utils.storage import get_storage
 
 st.set_page_config(page_title="購入確認", layout="centered")
 st.title("購入確認画面")
@@ -42,21 +42,18 @@ if not product:
 # 🔑 OAuth認証
 # ============================================
 try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
-    sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
+    get_product_sheet()
+    storage = get_storage()
 except Exception as e:
     st.error(f"Google Sheetsの認証に失敗しました: {e}")
     st.stop()
 
 # ============================================
-# 🆕 商品情報を最新化（シートから再取得）
+# 🆕 商品情報を最新化（共有スナップショットから再取得）
 # ============================================
 product_id = product.get("商品ID")
 try:
-    all_data = sheet.get_all_records()
-    updated = next((row for row in all_data if row.get("商品ID") == product_id), None)
+    updated = storage.find(product_id)
     if updated:
         st.session_state["selected_product"] = updated
         product = updated
@@ -130,7 +127,7 @@ if current_img:
     st.markdown(
         f"""
         <div class="image-box">
-            <img src="{current_img}" />
+            {image_tag(current_img, "gallery")}
         </div>
         """,
         unsafe_allow_html=True
@@ -148,7 +145,7 @@ for idx, (col, url) in enumerate(zip(thumb_cols, thumb_urls)):
         st.markdown(
             f"""
             <div class="thumb-box">
-                <img src="{url}" />
+                {image_tag(url, "thumb")}
             </div>
             """,
             unsafe_allow_html=True
@@ -187,19 +184,21 @@ if status == "出品中":
 
     if st.button("購入する", key="buy_main"):
         try:
-            row_index = next((i for i, row in enumerate(all_data) if row.get("商品ID") == product_id), None)
-            if row_index is None:
-                st.error("商品が見つかりませんでした。")
-                st.stop()
-
             jst = pytz.timezone("Asia/Tokyo")
             now = datetime.now(jst).strftime("%Y-%m-%d %H:%M:%S")
 
-            sheet.update_cell(row_index + 2, 13, current_user_id)
-            sheet.update_cell(row_index + 2, 14, st.session_state.get("username", ""))
-            sheet.update_cell(row_index + 2, 15, now)
-            sheet.update_cell(row_index + 2, 16, "購入手続き中")
-            time.sleep(1)
+            # 「出品中」のままの場合だけ M〜P 列を1回の範囲更新で書き込む
+            result = storage.transition(product_id, "出品中", "購入手続き中", {
+                "購入者": current_user_id,
+                "購入者名": st.session_state.get("username", ""),
+                "購入日時": now,
+            })
+            if result is None:
+                st.error("商品が見つかりませんでした。")
+                st.stop()
+            if not result:
+                st.error("すでに購入済みか、取下げられた商品です。")
+                st.stop()
 
             st.success("購入手続きに進みます")
             st.switch_page("pages/5_支払い画面.py")
@@ -1,16 +1,15 @@
 import streamlit as st
-import gspread
-import json
 from PIL import Image
 from datetime import datetime
-from google.oauth2.credentials import Credentials
 import pytz
-import time
 import smtplib
 from email.mime.text import MIMEText
 from email.utils import formatdate
 import pandas as pd
 
+from utils.sheet_client import get_product_sheet
+from utils.storage import get_storage
+
 st.set_page_config(page_title="支払い画面", layout="centered")
 st.title("支払い画面")
 
@@ -45,22 +44,18 @@ if not product:
 # OAuth 認証
 # ---------------------------------------------------------
 try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
-    sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
-    user_sheet = gc.open(st.secrets["USER_SHEET_NAME"]).sheet1
+    get_product_sheet()
+    storage = get_storage()
 except Exception as e:
     st.error(f"Google Sheetsの認証に失敗しました: {e}")
     st.stop()
 
 # ---------------------------------------------------------
-# 🆕 商品情報を最新化（シートから再取得）
+# 🆕 商品情報を最新化（共有スナップショットから再取得）
 # ---------------------------------------------------------
 product_id = product.get("商品ID")
 try:
-    all_data = sheet.get_all_records()
-    updated = next((row for row in all_data if row.get("商品ID") == product_id), None)
+    updated = storage.find(product_id)
     if updated:
         st.session_state["selected_product"] = updated
         product = updated
@@ -142,7 +137,7 @@ else:
     with col1:
         if st.button("送信する"):
             try:
-                user_df = pd.DataFrame(user_sheet.get_all_records(), dtype=str)
+                user_df = pd.DataFrame(storage.user_records(), dtype=str)
 
                 # 🔥 修正：ログイン中ユーザーのIDを使用（product["購入者"] は使わない）
                 buyer_id = str(st.session_state.get("id", "")).strip()
@@ -211,24 +206,21 @@ st.subheader("支払い後の操作")
 if st.button("支払い済"):
     try:
         product_id = product.get("商品ID")
-        all_data = sheet.get_all_records()
-        row_index = next((i for i, row in enumerate(all_data) if row.get("商品ID") == product_id), None)
+        # ステータス更新（「購入手続き中」のままの場合だけ）
+        result = storage.transition(product_id, "購入手続き中", "支払い済")
 
-        if row_index is None:
+        if result is None:
             st.error("商品が見つかりませんでした。")
             st.stop()
 
-        current_status = all_data[row_index].get("ステータス", "")
-        if current_status != "購入手続き中":
+        if not result:
             st.warning("現在のステータスでは支払い処理を受け付けられません。")
             st.stop()
 
-        # ステータス更新
-        sheet.update_cell(row_index + 2, 16, "支払い済")
-        time.sleep(1)
+        current = storage.find(product_id)
 
         # メール送信処理
-        user_df = pd.DataFrame(user_sheet.get_all_records(), dtype=str)
+        user_df = pd.DataFrame(storage.user_records(), dtype=str)
         seller_id = str(product.get("出品者", "")).strip()
         buyer_id = str(product.get("購入者", "")).strip()
 
@@ -242,7 +234,7 @@ if st.button("支払い済"):
         product_name = product.get("商品名", "")
         price = product.get("価格", "")
         category = product.get("カテゴリ", "")
-        purchase_time = all_data[row_index].get("購入日時", "")
+        purchase_time = current.get("購入日時", "")
 
         subject = f"システム自動配信：{seller_name}さんの出品「{product_name}」を{buyer_name}さんが購入しました"
 
@@ -1,9 +1,11 @@
 import streamlit as st
-import gspread
-import json
-from google.oauth2.credentials import Credentials
 from datetime import datetime
 
+from utils.image_variants import image_tag
+from utils.local_replica import replica_ready
+from utils.sheet_client import get_product_sheet
+from utils.storage import get_storage
+
 st.set_page_config(page_title="マイページ（購入）", layout="centered")
 st.title("マイページ（購入）")
 
@@ -26,27 +28,21 @@ else:
     st.stop()
 
 # ============================================
-# 🔑 OAuth認証
+# 🔑 OAuth認証（複製から読めるときは Sheets に繋がなくてよい）
 # ============================================
-try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
-    sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
-except Exception as e:
-    st.error(f"Google Sheetsの認証に失敗しました: {e}")
-    st.stop()
+if not replica_ready():
+    try:
+        get_product_sheet()
+    except Exception as e:
+        st.error(f"Google Sheetsの認証に失敗しました: {e}")
+        st.stop()
 
 # ============================================
 # 📄 購入履歴取得
 # ============================================
 try:
-    raw_data = sheet.get_all_records()
     user_id = str(st.session_state.get("id", "")).strip()
-    purchased_items = [
-        row for row in raw_data
-        if str(row.get("購入者", "")).strip() == user_id
-    ]
+    purchased_items = get_storage().by_buyer(user_id)
 except Exception as e:
     st.error(f"購入履歴の取得に失敗しました: {e}")
     st.stop()
@@ -163,7 +159,7 @@ if purchased_items:
             st.markdown(
                 f"""
                 <div class="image-box">
-                    <img src="{current_img}" />
+                    {image_tag(current_img, "gallery")}
                 </div>
                 """,
                 unsafe_allow_html=True
@@ -182,7 +178,7 @@ if purchased_items:
                 st.markdown(
                     f"""
                     <div class="thumb-box">
-                        <img src="{url}" />
+                        {image_tag(url, "thumb")}
                     </div>
                     """,
                     unsafe_allow_html=True
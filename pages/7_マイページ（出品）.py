@@ -1,9 +1,11 @@
 import streamlit as st
-import gspread
-import json
-from google.oauth2.credentials import Credentials
 from datetime import datetime
 
+from utils.image_variants import image_tag
+from utils.local_replica import replica_ready
+from utils.sheet_client import get_product_sheet
+from utils.storage import get_storage
+
 st.set_page_config(page_title="マイページ（出品）", layout="centered")
 st.title("マイページ（出品）")
 
@@ -29,16 +31,10 @@ else:
 # 🔑 OAuth認証（商品一覧＋usersシート）
 # ============================================
 try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
-
-    # 商品一覧シート
-    sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
-
-    # usersシート（購入者の所属を逆引きするため）
-    users_sheet = gc.open(st.secrets["USER_SHEET_NAME"]).sheet1
-    users_data = users_sheet.get_all_records()
+    # 商品一覧シート（複製から読めるときは Sheets に繋がなくてよい）
+    if not replica_ready():
+        get_product_sheet()
+    storage = get_storage()
 
 except Exception as e:
     st.error(f"Google Sheetsの認証に失敗しました: {e}")
@@ -48,12 +44,8 @@ except Exception as e:
 # 📄 出品履歴取得
 # ============================================
 try:
-    raw_data = sheet.get_all_records()
     user_id = str(st.session_state.get("id", "")).strip()
-    my_items = [
-        row for row in raw_data
-        if str(row.get("出品者", "")).strip() == user_id
-    ]
+    my_items = storage.by_seller(user_id)
 except Exception as e:
     st.error(f"出品履歴の取得に失敗しました: {e}")
     st.stop()
@@ -126,7 +118,7 @@ if my_items:
             st.markdown(
                 f"""
                 <div class="image-box">
-                    <img src="{current_img}" />
+                    {image_tag(current_img, "gallery")}
                 </div>
                 """,
                 unsafe_allow_html=True
@@ -145,7 +137,7 @@ if my_items:
                 st.markdown(
                     f"""
                     <div class="thumb-box">
-                        <img src="{url}" />
+                        {image_tag(url, "thumb")}
                     </div>
                     """,
                     unsafe_allow_html=True
@@ -180,10 +172,7 @@ if my_items:
             buyer_name = item.get("購入者名", "不明")
 
             # usersシートから逆引き
-            buyer_info = next(
-                (u for u in users_data if str(u.get("id", "")).strip() == buyer_id),
-                None
-            )
+            buyer_info = storage.find_user(buyer_id)
 
             buyer_dept = buyer_info.get("department", "不明") if buyer_info else "不明"
 
@@ -211,21 +200,19 @@ if my_items:
         with colB:
             if status == "出品中":
                 if st.button("取下げ", key=f"withdraw_{product_id}"):
-                    row_index = next((i for i, row in enumerate(raw_data)
-                                      if row.get("商品ID") == product_id), None)
-                    if row_index is not None:
-                        sheet.update_cell(row_index + 2, 16, "取下げ")
+                    if storage.transition(product_id, "出品中", "取下げ", defer=True):
                         st.success("商品を取下げました")
                         st.rerun()
+                    else:
+                        st.warning("ステータスが変更されたため取下げできませんでした。")
 
             elif status == "取下げ":
                 if st.button("出品に戻す", key=f"restore_{product_id}"):
-                    row_index = next((i for i, row in enumerate(raw_data)
-                                      if row.get("商品ID") == product_id), None)
-                    if row_index is not None:
-                        sheet.update_cell(row_index + 2, 16, "出品中")
+                    if storage.transition(product_id, "取下げ", "出品中", defer=True):
                         st.success("商品を再出品しました")
                         st.rerun()
+                    else:
+                        st.warning("ステータスが変更されたため再出品できませんでした。")
 
             else:
                 st.caption("※ この商品は現在操作できません")
@@ -1,8 +1,7 @@
 import streamlit as st
-import gspread
-import json
 import pandas as pd
-from google.oauth2.credentials import Credentials
+
+from utils.storage import get_storage
 
 st.set_page_config(page_title="部署別の売買状況", layout="wide")
 st.title("📊 部署別の売買状況ダッシュボード")
@@ -17,17 +16,11 @@ if st.session_state.get("logged_in"):
 # 🔑 OAuth認証（ログイン不要でも内部で実行OK）
 # ============================================
 try:
-    creds_dict = json.loads(st.secrets["OAUTH_TOKEN"])
-    creds = Credentials.from_authorized_user_info(creds_dict)
-    gc = gspread.authorize(creds)
-
     # 商品一覧
-    product_sheet = gc.open(st.secrets["PRODUCT_SHEET_NAME"]).sheet1
-    product_data = product_sheet.get_all_records()
+    product_data = get_storage().records()
 
     # users（department_big を含む）
-    users_sheet = gc.open(st.secrets["USER_SHEET_NAME"]).sheet1
-    users_data = users_sheet.get_all_records()
+    users_data = get_storage().user_records()
 
 except Exception as e:
     st.error(f"Google Sheetsの認証に失敗しました: {e}")
@@ -0,0 +1,88 @@
+import re
+
+import pytest
+from gspread.utils import numericise_all
+
+from utils.product_catalog import COLUMNS
+
+_RANGE_RE = re.compile(r"([A-Z])(\d+)(?::([A-Z])(\d+)?)?$")
+
+
+class FakeWorksheet:
+    """商品シートの代わり（gspread の Worksheet のうちカタログが使う分だけ）
+
+    呼ばれたメソッド名を calls に残す。
+    """
+
+    def __init__(self, rows):
+        self.rows = [dict(row) for row in rows]
+        self.calls = []
+
+    def _cells(self, range_name):
+        m = _RANGE_RE.match(range_name)
+        first, last = ord(m.group(1)) - 65, ord(m.group(3) or m.group(1)) - 65
+        start = int(m.group(2))
+        if m.group(4):
+            end = int(m.group(4))
+        else:
+            end = len(self.rows) + 1 if m.group(3) else start
+        return first, last, start, min(end, len(self.rows) + 1)
+
+    def _read(self, range_name):
+        first, last, start, end = self._cells(range_name)
+        return [
+            [str(self.rows[r - 2][COLUMNS[c]]) for c in range(first, last + 1)]
+            for r in range(start, end + 1)
+        ]
+
+    def _write(self, range_name, values):
+        first, _, start, _ = self._cells(range_name)
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                self.rows[start - 2 + i][COLUMNS[first + j]] = value
+
+    def get_all_records(self):
+        self.calls.append("get_all_records")
+        # gspread と同じく数値に見える値は数値にして返す
+        return [dict(zip(COLUMNS, numericise_all([str(row[c]) for c in COLUMNS]))) for row in self.rows]
+
+    def cell(self, row, col):
+        self.calls.append("cell")
+
+        class Cell:
+            value = self.rows[row - 2][COLUMNS[col - 1]]
+
+        return Cell()
+
+    def batch_get(self, ranges):
+        self.calls.append("batch_get")
+        return [self._read(r) for r in ranges]
+
+    def update(self, range_name, values):
+        self.calls.append("update")
+        self._write(range_name, values)
+
+    def batch_update(self, data):
+        self.calls.append("batch_update")
+        for item in data:
+            self._write(item["range"], item["values"])
+
+    def append_row(self, values):
+        self.calls.append("append_row")
+        self.rows.append(dict(zip(COLUMNS, values)))
+        row_num = len(self.rows) + 1
+        return {"updates": {"updatedRange": f"シート1!A{row_num}:P{row_num}"}}
+
+
+def product(product_id, status="出品中", buyer=""):
+    row = dict.fromkeys(COLUMNS, "")
+    row.update(
+        商品ID=product_id, 商品名=f"商品{product_id}", 価格=1000, 画像URL="https://example.com/a.png",
+        出品者="111", 投稿日時="2025-01-01 10:00:00", 購入者=buyer, ステータス=status,
+    )
+    return row
+
+
+@pytest.fixture
+def sheet():
+    return FakeWorksheet([product("p1"), product("p2"), product("p3")])
@@ -0,0 +1,160 @@
+"""画像プロキシのテスト（CDN の代わりにローカルの HTTP サーバーを使う）"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, quote, urlparse
+from urllib.request import Request, urlopen
+
+import pytest
+
+from utils.image_proxy import CACHE_CONTROL, DiskCache, ImageProxy
+
+
+@pytest.fixture
+def cdn():
+    """パスに応じた画像を返す CDN の代わり。受けたリクエストを hits に残す"""
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            parsed = urlparse(self.path)
+            if parsed.path == "/demo/redirect":
+                self.send_response(302)
+                self.send_header("Location", parse_qs(parsed.query)["to"][0])
+                self.end_headers()
+                return
+            # 同時アクセスが取得中に重なるよう少し待つ
+            time.sleep(0.1)
+            body = b"IMG" + self.path.encode() * 100
+            self.send_response(200)
+            self.send_header("Content-Type", "image/webp")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.hits = hits
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    server.url = lambda name: f"{server.base}/demo/image/upload/v1/{name}.png"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    proxy = ImageProxy(
+        DiskCache(str(tmp_path / "cache"), max_bytes=6000), "http://unused", ["127.0.0.1"], cloud_name="demo",
+    )
+    server = proxy.serve("127.0.0.1", 0)
+    proxy.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield proxy
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url, headers=None):
+    """(ステータス, ヘッダー, 本文)"""
+    try:
+        with urlopen(Request(url, headers=headers or {})) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as e:
+        return e.code, e.headers, b""
+
+
+def test_concurrent_misses_fetch_once(cdn, proxy):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(fetch(proxy.url_for(cdn.url("a")))))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(cdn.hits) == 1
+    assert [status for status, _, _ in results] == [200] * 5
+    assert len({body for _, _, body in results}) == 1
+
+
+def test_repeat_view_is_served_from_cache(cdn, proxy):
+    status, headers, body = fetch(proxy.url_for(cdn.url("a")))
+    assert status == 200
+    assert headers["Cache-Control"] == CACHE_CONTROL
+    assert headers["Content-Type"] == "image/webp"
+
+    again = fetch(proxy.url_for(cdn.url("a")))
+    assert again[0] == 200 and again[2] == body
+    assert len(cdn.hits) == 1
+
+
+def test_matching_etag_returns_304(cdn, proxy):
+    _, headers, _ = fetch(proxy.url_for(cdn.url("a")))
+    status, _, body = fetch(proxy.url_for(cdn.url("a")), {"If-None-Match": headers["ETag"]})
+    assert status == 304
+    assert body == b""
+
+
+def test_disallowed_host_is_rejected(proxy):
+    url = "http://example.com/x.png"
+    assert proxy.url_for(url) == url
+    status, _, _ = fetch(f"{proxy.base_url}/img?u={quote(url, safe='')}")
+    assert status == 403
+
+
+def test_only_the_configured_cloud_is_proxied(cdn, proxy):
+    assert proxy.allows(cdn.url("a"))
+    for url in [
+        f"{cdn.base}/other/image/upload/v1/a.png",
+        f"{cdn.base}/demo/../other/image/upload/v1/a.png",
+        f"{cdn.base}/demo/%2e%2e/other/image/upload/v1/a.png",
+        f"{cdn.base}/demo",
+    ]:
+        assert not proxy.allows(url)
+        assert proxy.url_for(url) == url
+        assert fetch(f"{proxy.base_url}/img?u={quote(url, safe='')}")[0] == 403
+    assert cdn.hits == []
+
+
+def test_redirect_within_allowed_urls_is_followed(cdn, proxy):
+    url = f"{cdn.base}/demo/redirect?to={quote(cdn.url('b'), safe='')}"
+    status, _, body = fetch(proxy.url_for(url))
+    assert status == 200
+    assert body.startswith(b"IMG/demo/image/upload/v1/b.png")
+
+
+@pytest.mark.parametrize("target", [
+    "http://localhost:{port}/demo/image/upload/v1/a.png",
+    "http://127.0.0.1:{port}/other/image/upload/v1/a.png",
+])
+def test_redirect_outside_allowed_urls_is_refused(cdn, proxy, target):
+    target = target.format(port=cdn.server_address[1])
+    url = f"{cdn.base}/demo/redirect?to={quote(target, safe='')}"
+    assert fetch(proxy.url_for(url))[0] == 502
+    # リダイレクト先には取りに行っていない
+    assert len(cdn.hits) == 1
+
+
+def test_eviction_keeps_cache_under_max_bytes(cdn, proxy):
+    for name in "abcdefg":
+        assert fetch(proxy.url_for(cdn.url(name)))[0] == 200
+    directory = proxy.cache.directory
+    total = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+    assert total <= proxy.cache.max_bytes
+
+    # 追い出された最初の画像は取り直す
+    fetch(proxy.url_for(cdn.url("a")))
+    assert len(cdn.hits) == 8
+
+    # 再起動しても残っているキャッシュを読み直す
+    reopened = DiskCache(directory, max_bytes=proxy.cache.max_bytes)
+    assert reopened._total == proxy.cache._total
+    assert set(reopened._entries) == set(proxy.cache._entries)
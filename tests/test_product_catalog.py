@@ -0,0 +1,55 @@
+"""ProductCatalog のステータス遷移のテスト"""
+import threading
+
+from utils.product_catalog import ProductCatalog
+
+
+def test_second_buyer_gets_false(sheet):
+    catalog = ProductCatalog(lambda: sheet)
+    assert catalog.transition("p1", "出品中", "購入手続き中", {"購入者": "201"}) is True
+    assert catalog.transition("p1", "出品中", "購入手続き中", {"購入者": "202"}) is False
+    assert sheet.rows[0]["購入者"] == "201"
+    assert catalog.find("p1")["購入者"] == "201"
+
+
+def test_concurrent_buyers_only_one_wins(sheet):
+    catalog = ProductCatalog(lambda: sheet)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda buyer=buyer: results.append(
+                catalog.transition("p1", "出品中", "購入手続き中", {"購入者": buyer})
+            )
+        )
+        for buyer in ["201", "202", "203", "204", "205"]
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == [False, False, False, False, True]
+
+
+def test_unknown_product_returns_none(sheet):
+    catalog = ProductCatalog(lambda: sheet)
+    assert catalog.transition("p9", "出品中", "購入手続き中") is None
+
+
+def test_transition_bumps_version_only_when_something_changes(sheet):
+    catalog = ProductCatalog(lambda: sheet)
+    catalog.find("p1")
+    version = catalog.version()
+    assert catalog.transition("p1", "購入手続き中", "支払い済み") is False
+    assert catalog.version() == version
+
+    assert catalog.transition("p1", "出品中", "購入手続き中", {"購入者": "201"}) is True
+    assert catalog.version() == version + 1
+    # 読み直した M〜P 列（数値の購入者ID）がスナップショットと同じなら版は進まない
+    assert catalog.transition("p1", "出品中", "購入手続き中", {"購入者": "202"}) is False
+    assert catalog.version() == version + 1
+
+    # シートの外で変わっていればスナップショットに取り込む
+    sheet.rows[0]["ステータス"] = "取下げ"
+    assert catalog.transition("p1", "購入手続き中", "支払い済み") is False
+    assert catalog.version() == version + 2
+    assert catalog.find("p1")["ステータス"] == "取下げ"
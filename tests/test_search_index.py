@@ -0,0 +1,101 @@
+"""商品検索の索引・絞り込み・ファセットのテスト"""
+import pytest
+
+from utils.search_index import ALL, CatalogView, SearchIndex, normalize
+
+
+def item(product_id, name, price, category="服", condition="新品", status="出品中",
+         posted="2025-01-01 10:00:00", description=""):
+    return {
+        "商品ID": product_id, "商品名": name, "説明": description, "価格": price,
+        "カテゴリ": category, "状態": condition, "ステータス": status, "投稿日時": posted,
+    }
+
+
+ROWS = [
+    item("a", "シャツ", 500, posted="2025-01-05 10:00:00"),
+    item("b", "ｼｬﾂ 白", "1,200", condition="中古", posted="2025-01-04 10:00:00"),
+    item("c", "本", 300, category="本", posted="2025-01-03 10:00:00"),
+    item("d", "Tシャツ", 800, status="購入手続き中", posted="2025-01-02 10:00:00"),
+    item("e", "ノート", 800, category="本", condition="中古", status="取下げ", posted="2025-01-06 10:00:00"),
+    item("f", "かばん", 2000, category="かばん", posted="不明"),
+]
+
+
+@pytest.fixture
+def view():
+    return CatalogView(ROWS)
+
+
+def ids(view, positions):
+    return [row["商品ID"] for row in view.take(positions)]
+
+
+def test_normalize_folds_width_case_and_kana():
+    assert normalize("ｼｬﾂ") == normalize("シャツ") == normalize("しゃつ")
+    assert normalize("ＡＢＣ") == "abc"
+
+
+def test_search_matches_regardless_of_kana_and_width():
+    index = SearchIndex()
+    index.update(ROWS)
+    assert index.search("しゃつ") == {"a", "b", "d"}
+    assert index.search("ｼｬﾂ 白") == {"b"}
+    assert index.search("tｼｬﾂ") == {"d"}
+    assert index.search("ない") == set()
+    assert index.search("") == {row["商品ID"] for row in ROWS}
+
+
+def test_search_index_updates_changed_rows_only():
+    index = SearchIndex()
+    index.update(ROWS)
+    rows = [dict(ROWS[0], 商品名="ズボン")] + ROWS[1:3]
+    index.update(rows)
+    assert len(index) == 3
+    assert index.search("しゃつ") == {"b"}
+    assert index.search("ずぼん") == {"a"}
+
+
+def test_sort_orders(view):
+    assert ids(view, view.select({}, "新着順")) == ["e", "a", "b", "c", "d", "f"]
+    assert ids(view, view.select({}, "価格が安い順")) == ["c", "a", "d", "e", "b", "f"]
+    assert ids(view, view.select({}, "価格が高い順")) == ["f", "b", "d", "e", "a", "c"]
+
+
+def test_price_bounds_for_both_price_sorts(view):
+    assert view.price_bounds() == (300, 2000)
+    price_range = (500, 1200)
+    assert ids(view, view.select({}, "価格が安い順", price_range)) == ["a", "d", "e", "b"]
+    assert ids(view, view.select({}, "価格が高い順", price_range)) == ["b", "d", "e", "a"]
+    assert ids(view, view.select({}, "新着順", price_range)) == ["e", "a", "b", "d"]
+    # 範囲の端の値ちょうどで切る・範囲に何も無い
+    assert ids(view, view.select({}, "価格が高い順", (800, 800))) == ["d", "e"]
+    assert ids(view, view.select({}, "価格が安い順", (900, 1100))) == []
+    assert CatalogView([]).price_bounds() == (0, 0)
+
+
+def test_filters_apply_with_price_range(view):
+    filters = view.filters(None, "服", ALL, "出品中のみ")
+    assert ids(view, view.select(filters, "価格が安い順", (400, 2000))) == ["a", "b"]
+    filters = view.filters({"b", "d", "zz"}, ALL, ALL, "売却済")
+    assert ids(view, view.select(filters, "新着順")) == ["d"]
+    # 選択肢に無い値は何も合わない
+    assert ids(view, view.select(view.filters(None, "家電", ALL, ALL), "新着順")) == []
+
+
+def test_facets_skip_their_own_filter(view):
+    filters = view.filters(None, "本", "中古", "出品中のみ")
+    facets = view.facets("key", filters)
+    # カテゴリの件数は 状態=中古・出品中のみ で数える（b だけ）
+    assert facets["カテゴリ"] == {ALL: 1, "かばん": 0, "本": 0, "服": 1}
+    # 状態の件数は カテゴリ=本・出品中のみ で数える（c だけ）
+    assert facets["状態"] == {ALL: 1, "中古": 0, "新品": 1}
+    # ステータスの件数は カテゴリ=本・状態=中古 で数える（e だけ）
+    assert facets["ステータス"] == {ALL: 1, "出品中のみ": 0, "売却済": 0}
+
+
+def test_facets_respect_price_range_and_are_cached(view):
+    facets = view.facets("range", {}, (800, 2000))
+    assert facets["カテゴリ"] == {ALL: 4, "かばん": 1, "本": 1, "服": 2}
+    assert facets["ステータス"] == {ALL: 4, "出品中のみ": 2, "売却済": 1}
+    assert view.facets("range", {}, None) is facets
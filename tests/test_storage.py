@@ -0,0 +1,35 @@
+"""ストレージバックエンドのテスト"""
+import pytest
+
+from utils.product_catalog import COLUMNS
+from utils.storage import SqliteBackend, StorageBackend
+
+
+def values(product_id, status="出品中", buyer=""):
+    row = dict.fromkeys(COLUMNS, "")
+    row.update(商品ID=product_id, 商品名="シャツ", 価格=500, 購入者=buyer, ステータス=status)
+    return [row[c] for c in COLUMNS]
+
+
+def test_backend_missing_a_method_fails_on_creation():
+    class Partial(StorageBackend):
+        def records(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_sqlite_edit_keeps_purchase_columns(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "products.db"), users=None)
+    backend.append_product(values("p1"))
+    stale = values("p1")
+    assert backend.transition("p1", "出品中", "購入手続き中", {"購入者": "201"}) is True
+
+    # 購入前に開いた編集画面の値で保存しても、購入は消えない
+    stale[COLUMNS.index("商品名")] = "白いシャツ"
+    assert backend.update_product("p1", stale) is True
+    row = backend.find("p1")
+    assert row["商品名"] == "白いシャツ"
+    assert row["購入者"] == "201" and row["ステータス"] == "購入手続き中"
+    assert backend.update_product("p9", stale) is False
@@ -0,0 +1,109 @@
+"""WriteBehindQueue と ProductCatalog の後書きのテスト"""
+import json
+
+from utils.product_catalog import ProductCatalog
+from utils.write_behind import WriteBehindQueue
+
+
+def test_pending_withdrawal_blocks_purchase(sheet, tmp_path):
+    catalog = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(catalog, str(tmp_path / "journal.jsonl"))
+    assert queue.transition("p1", "出品中", "取下げ") is True
+    # シートはまだ出品中のまま
+    assert sheet.rows[0]["ステータス"] == "出品中"
+
+    assert catalog.transition("p1", "出品中", "購入手続き中", {"購入者": "201"}) is False
+    assert sheet.rows[0]["購入者"] == ""
+    assert catalog.find("p1")["ステータス"] == "取下げ"
+
+
+def test_flush_sends_single_batch_update(sheet, tmp_path):
+    catalog = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(catalog, str(tmp_path / "journal.jsonl"))
+    queue.submit("p1", {"商品名": "新しい名前", "価格": 500})
+    queue.submit("p3", {"説明": "説明を追加"})
+    queue.transition("p2", "出品中", "取下げ")
+    sheet.calls.clear()
+
+    queue.flush()
+
+    assert sheet.calls.count("batch_update") == 1
+    assert "update" not in sheet.calls
+    assert sheet.rows[0]["商品名"] == "新しい名前" and sheet.rows[0]["価格"] == 500
+    assert sheet.rows[1]["ステータス"] == "取下げ"
+    assert sheet.rows[2]["説明"] == "説明を追加"
+    assert catalog.pending_changes() == {}
+    assert (tmp_path / "journal.jsonl").read_text(encoding="utf-8") == ""
+
+
+def test_journal_is_replayed_after_crash(sheet, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    catalog = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(catalog, str(journal))
+    queue.submit("p1", {"商品名": "新しい名前"})
+    queue.transition("p2", "出品中", "取下げ")
+    # 書き出す前に落ちた（最終行は書き込み途中）
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"id": "p3", "fie')
+
+    restarted = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(restarted, str(journal))
+    assert restarted.pending_changes() == {
+        "p1": {"商品名": "新しい名前"},
+        "p2": {"ステータス": "取下げ"},
+    }
+    # シートにはまだ無いが、読み込んだスナップショットには当て直される
+    assert sheet.rows[0]["商品名"] == "商品p1"
+    assert restarted.find("p1")["商品名"] == "新しい名前"
+    assert restarted.transition("p2", "出品中", "購入手続き中") is False
+
+    queue.flush()
+    assert sheet.rows[0]["商品名"] == "新しい名前"
+    assert sheet.rows[1]["ステータス"] == "取下げ"
+    assert journal.read_text(encoding="utf-8") == ""
+
+
+def test_flush_drops_status_changed_outside(sheet, tmp_path):
+    catalog = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(catalog, str(tmp_path / "journal.jsonl"))
+    assert queue.transition("p1", "出品中", "取下げ") is True
+    queue.submit("p1", {"説明": "説明を追加"})
+    assert queue.transition("p2", "出品中", "取下げ") is True
+    # 書き出す前に事務局が p1 をシート上で売却済みにした
+    sheet.rows[0]["ステータス"] = "支払い済み"
+
+    queue.flush()
+
+    assert sheet.rows[0]["ステータス"] == "支払い済み"
+    assert sheet.rows[0]["説明"] == "説明を追加"
+    assert sheet.rows[1]["ステータス"] == "取下げ"
+    assert catalog.pending_changes() == {}
+    assert catalog.find("p1")["ステータス"] == "支払い済み"
+
+
+def test_chained_transitions_compare_with_first_from_status(sheet, tmp_path):
+    catalog = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(catalog, str(tmp_path / "journal.jsonl"))
+    assert queue.transition("p1", "出品中", "取下げ") is True
+    assert queue.transition("p1", "取下げ", "出品中") is True
+    assert queue.transition("p1", "出品中", "取下げ") is True
+    assert catalog.expected_statuses() == {"p1": "出品中"}
+
+    queue.flush()
+    assert sheet.rows[0]["ステータス"] == "取下げ"
+    assert catalog.expected_statuses() == {}
+
+
+def test_journal_keeps_from_status(sheet, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    queue = WriteBehindQueue(ProductCatalog(lambda: sheet), str(journal))
+    queue.transition("p1", "出品中", "取下げ")
+    entries = [json.loads(line) for line in journal.read_text(encoding="utf-8").splitlines()]
+    assert entries == [{"id": "p1", "fields": {"ステータス": "取下げ"}, "from": "出品中"}]
+
+    sheet.rows[0]["ステータス"] = "購入手続き中"
+    restarted = ProductCatalog(lambda: sheet)
+    queue = WriteBehindQueue(restarted, str(journal))
+    assert restarted.expected_statuses() == {"p1": "出品中"}
+    queue.flush()
+    assert sheet.rows[0]["ステータス"] == "購入手続き中"
@@ -0,0 +1,240 @@
+"""商品画像のプロキシとディスクキャッシュ（任意）
+
+会社端末から商品検索・購入画面・マイページを開くと、画像は1枚ずつ
+ブラウザが外部 CDN から取得するので、同じ人気商品の画像を何百人分も
+社外回線で取りに行くことになる。secrets に IMAGE_PROXY_PORT を設定すると、
+アプリと同じサーバーで小さな HTTP サーバーが動き、
+
+- 表示枠ごとの派生画像を CDN から1回だけ取得し
+- 上限サイズ付きのディスク LRU キャッシュに置いて
+- 長期のキャッシュヘッダー付きで返す
+
+ので、2回目以降はローカルディスクから配信される。Cloudinary の URL は
+版（v123...）を含み内容が変わらないため immutable で返してよい。
+
+ブラウザから見たプロキシの URL は IMAGE_PROXY_BASE_URL で指定する
+（IMAGE_PROXY_PORT を設定するなら必須）。localhost はブラウザ側の端末を
+指してしまうので使えない。アプリを https（ngrok など）で公開しているなら、
+プロキシも同じく https で公開した URL にする（http だと混在コンテンツとして
+画像が読まれない）。取得してよいホストは IMAGE_PROXY_ALLOWED_HOSTS に限る
+（既定は res.cloudinary.com のみ）。他のアカウントの画像まで取りに行かない
+よう、パスも CLOUDINARY_CLOUD_NAME のものに限る。リダイレクト先も同じ
+条件で確かめ、外れていれば追わない（社内のアドレスに向けられないように）。
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+import streamlit as st
+
+from utils.sheet_scheduler import SingleFlight
+
+DEFAULT_CACHE_DIR = "image_cache"
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_ALLOWED_HOSTS = ("res.cloudinary.com",)
+
+FETCH_TIMEOUT = 10
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class DiskCache:
+    """合計 max_bytes までのファイルキャッシュ（使われていないものから消す）"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # ファイル名 → サイズ（最後に使った順）
+        self._entries = OrderedDict()
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        # 再起動後も前回のキャッシュを使う（更新日時を最後に使った日時とみなす）
+        files = [e for e in os.scandir(directory) if e.is_file() and not e.name.endswith(".tmp")]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            size = entry.stat().st_size
+            self._entries[entry.name] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    def _name(self, key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """(content_type, data, etag) を返す。無ければ None"""
+        name = self._name(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                content_type, data = f.read().split(b"\n", 1)
+            os.utime(path)
+        except FileNotFoundError:
+            # 読む直前に追い出された
+            return None
+        return content_type.decode("ascii"), data, name
+
+    def put(self, key, content_type, data):
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        blob = content_type.encode("ascii") + b"\n" + data
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(blob) - self._entries.pop(name, 0)
+            self._entries[name] = len(blob)
+            self._evict()
+        return name
+
+
+class _CheckedRedirectHandler(HTTPRedirectHandler):
+    """allows(url) が False のリダイレクト先には進まない"""
+
+    def __init__(self, allows):
+        self._allows = allows
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not self._allows(newurl):
+            raise HTTPError(newurl, code, f"許可されていないリダイレクト先です: {newurl}", headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class ImageProxy:
+    """cloud_name を渡すと、その Cloudinary アカウントのパスだけを取得する"""
+
+    def __init__(self, cache, base_url, allowed_hosts=DEFAULT_ALLOWED_HOSTS, fetch=None, cloud_name=None):
+        self.cache = cache
+        self.base_url = base_url.rstrip("/")
+        self.allowed_hosts = set(allowed_hosts)
+        self.cloud_name = cloud_name
+        self._fetch = fetch or self._fetch_url
+        self._opener = build_opener(_CheckedRedirectHandler(self.allows))
+        self._flight = SingleFlight()
+
+    def allows(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or parsed.hostname not in self.allowed_hosts:
+            return False
+        if self.cloud_name is None:
+            return True
+        # ".." で別アカウントのパスに抜けられないようにする
+        segments = unquote(parsed.path).split("/")
+        return len(segments) > 2 and segments[1] == self.cloud_name and not {".", ".."} & set(segments)
+
+    def url_for(self, url):
+        """ブラウザに渡す画像 URL（プロキシできない URL はそのまま）"""
+        if not url or not self.allows(url):
+            return url
+        return f"{self.base_url}/img?u={quote(url, safe='')}"
+
+    def _fetch_url(self, url):
+        # f_auto の派生画像は Accept で形式が決まる。今のブラウザはどれも WebP を読める
+        request = Request(url, headers={"Accept": "image/webp,image/*;q=0.8"})
+        with self._opener.open(request, timeout=FETCH_TIMEOUT) as response:
+            content_type = response.headers.get("Content-Type", "")
+            data = response.read(MAX_IMAGE_BYTES + 1)
+        if not content_type.startswith("image/") or len(data) > MAX_IMAGE_BYTES:
+            raise ValueError(f"画像ではないか大きすぎます: {url}")
+        return content_type, data
+
+    def get(self, url):
+        """(content_type, data, etag) を返す。キャッシュに無ければ1回だけ取得する"""
+        cached = self.cache.get(url)
+        if cached is not None:
+            return cached
+
+        def load():
+            content_type, data = self._fetch(url)
+            etag = self.cache.put(url, content_type, data)
+            return content_type, data, etag
+
+        return self._flight.do(url, load)
+
+    # ============================================
+    # 🌐 HTTP サーバー
+    # ============================================
+    def handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                url = parse_qs(parsed.query).get("u", [""])[0]
+                if parsed.path != "/img" or not url:
+                    self.send_error(404)
+                    return
+                if not proxy.allows(url):
+                    self.send_error(403)
+                    return
+                try:
+                    content_type, data, etag = proxy.get(url)
+                except Exception:
+                    self.send_error(502)
+                    return
+
+                etag = f'"{etag}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", CACHE_CONTROL)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", CACHE_CONTROL)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host, port):
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+@st.cache_resource
+def get_image_proxy():
+    port = st.secrets.get("IMAGE_PROXY_PORT")
+    if not port:
+        return None
+    hosts = st.secrets.get("IMAGE_PROXY_ALLOWED_HOSTS", DEFAULT_ALLOWED_HOSTS)
+    if isinstance(hosts, str):
+        hosts = [h.strip() for h in hosts.split(",") if h.strip()]
+    proxy = ImageProxy(
+        DiskCache(
+            st.secrets.get("IMAGE_PROXY_CACHE_DIR", DEFAULT_CACHE_DIR),
+            int(st.secrets.get("IMAGE_PROXY_CACHE_BYTES", DEFAULT_CACHE_BYTES)),
+        ),
+        st.secrets["IMAGE_PROXY_BASE_URL"],
+        hosts,
+        cloud_name=st.secrets["CLOUDINARY_CLOUD_NAME"],
+    )
+    proxy.serve(st.secrets.get("IMAGE_PROXY_HOST", "0.0.0.0"), int(port))
+    return proxy
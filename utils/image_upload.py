@@ -0,0 +1,218 @@
+"""出品画像の加工と Cloudinary へのアップロード
+
+メイン画像・サブ画像1・サブ画像2 を1枚ずつ順に加工・アップロードすると、
+回線の遅いスマホでは3往復分待たされる。upload_images() は全プロセスで
+共有する上限付きのスレッドプールで並行して処理し、出品にかかる時間を
+いちばん遅い1枚分に近づける。
+
+デコード・縮小・エンコードは CPU を使い GIL を握るので、Streamlit の
+スクリプトスレッドではなく別プロセスのプールで行う。JPEG は draft モードで
+縮小しながらデコードし（12〜48MP の写真を全画素展開しない）、それでも
+画素数が上限を超える画像はデコード前に断る。
+
+保存形式は secrets の IMAGE_FORMAT（webp / jpeg / png、既定は webp）と
+IMAGE_QUALITY で切り替える。写真を可逆 PNG で保存すると 512px 幅でも
+数倍大きく、検索画面やギャラリーの表示が重くなるため。
+
+同じ画像（元ファイルのバイト列と加工条件が同じもの）を再び出品・保存した
+ときは、加工もアップロードもせず前回の secure_url を使う（編集モードでの
+再保存、失敗後の再実行、同じ写真の使い回しなど）。
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cloudinary.uploader
+import streamlit as st
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from utils.sheet_scheduler import SingleFlight
+
+MAX_WIDTH = 512
+UPLOAD_FOLDER = "products"
+
+OUTPUT_FORMATS = ("webp", "jpeg", "png")
+DEFAULT_FORMAT = "webp"
+DEFAULT_QUALITY = 80
+
+# draft 縮小後に展開してよい最大画素数（これを超える画像は受け付けない）
+MAX_SOURCE_PIXELS = 24_000_000
+
+# 同時に加工・アップロードする画像の上限（全セッション合計）
+UPLOAD_WORKERS = 6
+# 画像加工に使うプロセス数
+PROCESS_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# 加工方法を変えたら上げる（古いアップロード結果を使わないように）
+PROCESSING_VERSION = 1
+# 覚えておくアップロード結果の件数
+UPLOAD_CACHE_SIZE = 2048
+
+_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="image-upload")
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+class ImageUploadError(Exception):
+    """画像を読み込めない・アップロードできないときのエラー"""
+
+
+class UploadCache:
+    """元画像のハッシュ + 加工条件 → secure_url（古いものから捨てる）"""
+
+    def __init__(self, size=UPLOAD_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            url = self._urls.get(key)
+            if url is not None:
+                self._urls.move_to_end(key)
+            return url
+
+    def put(self, key, url):
+        with self._lock:
+            self._urls[key] = url
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.size:
+                self._urls.popitem(last=False)
+
+
+_upload_cache = UploadCache()
+# 同じ画像が同時にアップロードされたら1回で済ませる
+_upload_flight = SingleFlight()
+
+
+def upload_key(data, fmt, quality):
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest}:{MAX_WIDTH}:{fmt}:{quality}:{PROCESSING_VERSION}"
+
+
+def output_settings():
+    """secrets から保存形式と画質を読む"""
+    fmt = str(st.secrets.get("IMAGE_FORMAT", DEFAULT_FORMAT)).lower()
+    if fmt not in OUTPUT_FORMATS:
+        fmt = DEFAULT_FORMAT
+    return fmt, int(st.secrets.get("IMAGE_QUALITY", DEFAULT_QUALITY))
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def encode_image(img, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    """画像を fmt で保存したバイト列を返す
+
+    透過のある画像は JPEG にできないので PNG で保存する。EXIF（撮影位置など）・
+    XMP・コメントは書き出さない。色がずれないよう ICC プロファイルだけは残す。
+    """
+    alpha = _has_alpha(img)
+    if fmt == "jpeg" and alpha:
+        fmt = "png"
+    icc_profile = img.info.get("icc_profile")
+    img = img.convert("RGBA" if alpha else "RGB")
+    img.info = {}
+    extra = {"icc_profile": icc_profile} if icc_profile else {}
+
+    buf = io.BytesIO()
+    if fmt == "webp":
+        img.save(buf, format="WEBP", quality=quality, method=4, **extra)
+    elif fmt == "jpeg":
+        img.save(buf, format="JPEG", quality=quality, progressive=True, optimize=True, **extra)
+    else:
+        img.save(buf, format="PNG", optimize=True, **extra)
+    return buf.getvalue()
+
+
+def prepare_image(data, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    """アップロード用に画像を縮小・エンコードする（プロセスプール側で実行）"""
+    try:
+        img = Image.open(io.BytesIO(data))
+        # JPEG は 1/2〜1/8 に縮小しながらデコードする。回転前なので縦横どちらも
+        # MAX_WIDTH 以上残るように指定する
+        img.draft("RGB", (MAX_WIDTH, MAX_WIDTH))
+        if img.width * img.height > MAX_SOURCE_PIXELS:
+            raise ImageUploadError("画像の画素数が大きすぎます")
+        img = ImageOps.exif_transpose(img)
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise ImageUploadError("画像として読み込めませんでした")
+
+    if img.width > MAX_WIDTH:
+        ratio = MAX_WIDTH / img.width
+        img = img.resize((MAX_WIDTH, int(img.height * ratio)), reducing_gap=3.0)
+
+    return encode_image(img, fmt, quality)
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # スレッドを抱えたサーバープロセスを fork しないよう spawn で起動する
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def _reset_process_pool(broken):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is broken:
+            _process_pool = None
+
+
+def _process_and_upload(data, fmt, quality):
+    pool = _get_process_pool()
+    try:
+        processed = pool.submit(prepare_image, data, fmt, quality).result()
+    except BrokenProcessPool:
+        # 加工プロセスが落ちた。次のアップロードでプールを作り直す
+        _reset_process_pool(pool)
+        raise ImageUploadError("画像の加工に失敗しました。もう一度お試しください")
+
+    result = cloudinary.uploader.upload(io.BytesIO(processed), folder=UPLOAD_FOLDER)
+    return result["secure_url"]
+
+
+def process_and_upload(file, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    data = file.getvalue() if hasattr(file, "getvalue") else file.read()
+    key = upload_key(data, fmt, quality)
+    url = _upload_cache.get(key)
+    if url is None:
+        url = _upload_flight.do(key, lambda: _process_and_upload(data, fmt, quality))
+        _upload_cache.put(key, url)
+    return url
+
+
+def upload_images(files, on_progress=None):
+    """複数の画像を並行して加工・アップロードする
+
+    files は {名前: ファイル}（None のものは飛ばす）。戻り値は
+    ({名前: secure_url}, {名前: エラー})。1枚が失敗しても他の画像は続ける。
+    on_progress(完了数, 全体数) は呼び出し元のスレッドで呼ばれるので、
+    そのまま st.progress を更新してよい。
+    """
+    fmt, quality = output_settings()
+    futures = {
+        _pool.submit(process_and_upload, file, fmt, quality): name
+        for name, file in files.items() if file is not None
+    }
+    urls, errors = {}, {}
+    for done, future in enumerate(as_completed(futures), start=1):
+        name = futures[future]
+        try:
+            urls[name] = future.result()
+        except Exception as e:
+            errors[name] = e
+        if on_progress is not None:
+            on_progress(done, len(futures))
+    return urls, errors
@@ -0,0 +1,52 @@
+"""表示サイズに合わせた画像 URL（Cloudinary の変換 URL）
+
+商品検索のカードは 200px、購入画面・マイページのギャラリーは 260px、
+サムネイルは 60px の枠に表示するのに、どれも元の画像URL をそのまま
+読み込んでいた。image_tag() は枠に合う大きさの派生画像を Cloudinary の
+URL 変換で指定し（1x / 2x の srcset、形式・画質は f_auto / q_auto）、
+loading="lazy" で画面外の画像は後から読み込ませる。
+
+派生画像は最初に要求されたときに Cloudinary が作って CDN にキャッシュする
+ので、既にアップロード済みの画像にもそのまま使える。Cloudinary 以外の
+URL は変換せずに元の URL を使う。
+
+画像プロキシ（utils.image_proxy）が有効なら、派生画像の URL をプロキシ経由に
+書き換えて、社内からはアプリのサーバーのディスクキャッシュを読ませる。
+"""
+import html
+
+from utils.image_proxy import get_image_proxy
+
+CLOUDINARY_UPLOAD = "/image/upload/"
+
+# 表示枠ごとの派生画像（枠の大きさ・切り抜き方）
+VARIANTS = {
+    "card": {"width": 240, "height": 200, "crop": "limit"},
+    "gallery": {"width": 260, "height": 260, "crop": "limit"},
+    "thumb": {"width": 60, "height": 60, "crop": "fill"},
+}
+
+
+def variant_url(url, variant, dpr=1):
+    """url の派生画像の URL を返す（Cloudinary 以外はそのまま）"""
+    if not url or CLOUDINARY_UPLOAD not in url:
+        return url
+    spec = VARIANTS[variant]
+    transformation = f"c_{spec['crop']},w_{spec['width']},h_{spec['height']},f_auto,q_auto"
+    if dpr != 1:
+        transformation += f",dpr_{dpr:.1f}"
+    head, tail = url.split(CLOUDINARY_UPLOAD, 1)
+    return f"{head}{CLOUDINARY_UPLOAD}{transformation}/{tail}"
+
+
+def image_tag(url, variant):
+    """表示枠に合わせた <img> タグ（srcset・遅延読み込み付き）"""
+    proxy = get_image_proxy()
+    src = variant_url(url, variant)
+    src_2x = variant_url(url, variant, dpr=2)
+    if proxy is not None:
+        src, src_2x = proxy.url_for(src), proxy.url_for(src_2x)
+    src = html.escape(src, quote=True)
+    src_2x = html.escape(src_2x, quote=True)
+    srcset = f' srcset="{src} 1x, {src_2x} 2x"' if src_2x != src else ""
+    return f'<img src="{src}"{srcset} loading="lazy" decoding="async" />'
@@ -0,0 +1,229 @@
+"""商品シート・ユーザー管理シートのローカル SQLite 複製（任意）
+
+secrets に LOCAL_REPLICA_PATH を設定すると有効になる。裏のスレッドが
+共有キャッシュ（ProductCatalog / UserDirectory）の内容を定期的に SQLite に
+写し、商品検索・マイページ・ダッシュボードはインデックス付きのローカル
+クエリで読む。正本はあくまで Google Sheets で、アプリからの書き込みは
+カタログ経由でシートに書いたあと、この複製にも即座に反映する。
+
+ファイルはプロセスを再起動しても残るので、Sheets が一時的に落ちていても
+最後に同期した内容で読み込みを続けられる。
+"""
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from utils.product_catalog import COLUMNS, get_catalog
+from utils.user_directory import get_user_directory
+
+DEFAULT_SYNC_INTERVAL = 15
+
+PRODUCT_INDEXES = ["商品ID", "出品者", "購入者", "ステータス", "カテゴリ", "投稿日時"]
+
+
+def sql_name(name):
+    """SQL 識別子のクォート（列名は日本語のシート見出しをそのまま使う）"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def create_product_schema(conn):
+    """products テーブル（行番号 + A〜P 列）と索引を作る"""
+    columns = ", ".join(
+        f"{sql_name(c)} INTEGER" if c == "価格" else f"{sql_name(c)} TEXT" for c in COLUMNS
+    )
+    conn.execute(f"CREATE TABLE IF NOT EXISTS products (row_num INTEGER PRIMARY KEY, {columns})")
+    for column in PRODUCT_INDEXES:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {sql_name('idx_products_' + column)} "
+            f"ON products ({sql_name(column)})"
+        )
+
+
+class LocalReplica:
+    def __init__(self, path, catalog, users, interval=DEFAULT_SYNC_INTERVAL):
+        self._catalog = catalog
+        self._users = users
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._create_schema()
+        self._synced = {"products": None, "users": None}
+        self._write_seq = 0
+        self._product_syncs = 0
+        self.products = SqliteProducts(self)
+        self.users = SqliteUsers(self)
+        catalog.subscribe(self._apply_write)
+
+    # ============================================
+    # 🗂 スキーマ
+    # ============================================
+    def _create_schema(self):
+        with self._lock, self._conn:
+            create_product_schema(self._conn)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY)")
+
+    def _ensure_user_columns(self, columns):
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+        for column in columns:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE users ADD COLUMN {sql_name(column)} TEXT")
+
+    # ============================================
+    # 🔄 同期
+    # ============================================
+    def sync(self):
+        """共有キャッシュの内容が変わっていれば SQLite に写す"""
+        with self._lock:
+            seq = self._write_seq
+        products = self._catalog.records()
+        signature = hash(tuple(tuple(row.get(c) for c in COLUMNS) for row in products))
+        if signature != self._synced["products"]:
+            placeholders = ", ".join("?" * (len(COLUMNS) + 1))
+            with self._lock, self._conn:
+                if seq != self._write_seq:
+                    # 読んでいる間に書き込みがあった。古い内容で上書きせず次回に回す
+                    return
+                self._conn.execute("DELETE FROM products")
+                self._conn.executemany(
+                    f"INSERT INTO products VALUES ({placeholders})",
+                    [[i + 2] + [row.get(c, "") for c in COLUMNS] for i, row in enumerate(products)],
+                )
+                self._product_syncs += 1
+            self._synced["products"] = signature
+
+        users = self._users.records()
+        columns = list(users[0].keys()) if users else ["id"]
+        signature = hash(tuple(tuple(str(row.get(c, "")) for c in columns) for row in users))
+        if signature != self._synced["users"]:
+            names = ", ".join(sql_name(c) for c in columns)
+            placeholders = ", ".join("?" * len(columns))
+            with self._lock, self._conn:
+                self._ensure_user_columns(columns)
+                self._conn.execute("DELETE FROM users")
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO users ({names}) VALUES ({placeholders})",
+                    [[str(row.get(c, "")).strip() for c in columns] for row in users],
+                )
+            self._synced["users"] = signature
+
+    def _apply_write(self, row_num, fields, appended):
+        """カタログ経由の書き込みを即座に反映する（read-your-writes）"""
+        columns = [c for c in COLUMNS if c in fields]
+        with self._lock, self._conn:
+            self._write_seq += 1
+            if appended:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO products (row_num, {', '.join(sql_name(c) for c in columns)}) "
+                    f"VALUES (?, {', '.join('?' * len(columns))})",
+                    [row_num] + [fields[c] for c in columns],
+                )
+            else:
+                self._conn.execute(
+                    f"UPDATE products SET {', '.join(sql_name(c) + ' = ?' for c in columns)} "
+                    "WHERE row_num = ?",
+                    [fields[c] for c in columns] + [row_num],
+                )
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                # Sheets が落ちていても最後に同期した内容で読み続ける
+                pass
+            time.sleep(self.interval)
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def version(self):
+        """products テーブルの版（同期・書き込みのたびに変わる）"""
+        with self._lock:
+            return self._product_syncs, self._write_seq
+
+    def ready(self):
+        return self.query("SELECT 1 FROM products LIMIT 1") != []
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+
+class SqliteProducts:
+    """products テーブルに対して ProductCatalog と同じ読み込み API を提供する
+
+    db は query(sql, params) を持つもの（LocalReplica / SqliteBackend）。
+    """
+
+    _SELECT = f"SELECT {', '.join(sql_name(c) for c in COLUMNS)} FROM products"
+
+    def __init__(self, db):
+        self._db = db
+
+    def records(self):
+        return self._db.query(f"{self._SELECT} ORDER BY row_num")
+
+    def listed_products(self):
+        return self._db.query(
+            f"{self._SELECT} WHERE {sql_name('ステータス')} != '取下げ' "
+            f"AND {sql_name('商品名')} != '' AND {sql_name('価格')} != '' AND {sql_name('価格')} != 0 "
+            f"AND {sql_name('画像URL')} != '' ORDER BY row_num"
+        )
+
+    def find(self, product_id):
+        rows = self._db.query(f"{self._SELECT} WHERE {sql_name('商品ID')} = ?", (str(product_id),))
+        return rows[0] if rows else None
+
+    def by_buyer(self, user_id):
+        return self._db.query(
+            f"{self._SELECT} WHERE {sql_name('購入者')} = ? ORDER BY row_num", (str(user_id).strip(),)
+        )
+
+    def by_seller(self, user_id):
+        return self._db.query(
+            f"{self._SELECT} WHERE {sql_name('出品者')} = ? ORDER BY row_num", (str(user_id).strip(),)
+        )
+
+    def count_by_buyer_status(self, user_id, status):
+        rows = self._db.query(
+            f"SELECT COUNT(*) AS n FROM products WHERE {sql_name('購入者')} = ? AND {sql_name('ステータス')} = ?",
+            (str(user_id).strip(), status),
+        )
+        return rows[0]["n"]
+
+
+class SqliteUsers:
+    """users テーブルに対して UserDirectory と同じ読み込み API を提供する"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def records(self):
+        return self._db.query("SELECT * FROM users")
+
+    def find(self, user_id):
+        rows = self._db.query("SELECT * FROM users WHERE id = ?", (str(user_id).strip(),))
+        return rows[0] if rows else None
+
+
+@st.cache_resource
+def get_replica():
+    path = st.secrets.get("LOCAL_REPLICA_PATH")
+    if not path:
+        return None
+    replica = LocalReplica(
+        path, get_catalog(), get_user_directory(),
+        interval=float(st.secrets.get("LOCAL_REPLICA_SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL)),
+    )
+    replica.start()
+    return replica
+
+
+def replica_ready():
+    """複製が有効でデータがあるか（読むだけのページは Sheets が落ちていても表示できる）"""
+    replica = get_replica()
+    return replica is not None and replica.ready()
@@ -0,0 +1,584 @@
+"""商品シートのリポジトリ
+
+商品一覧を全ページ・全セッションで共有するスナップショットとして保持する。
+読み込みは TTL の間スナップショットを返し、アプリからの書き込み
+（update / append_row）はシートに反映したうえで
+スナップショットも即座に更新する。
+
+商品ID → シート行番号の索引をスナップショットと一緒に保持し、書き込み
+前には該当行の A 列1セルだけを読んで索引が正しいことを確かめる。
+出品者別・購入者別の索引と（購入者, ステータス）別の件数も同じスナップ
+ショットに持たせ、マイページやログイン画面はその利用者の行だけを見る。
+読み込みは SnapshotCache（single-flight + stale-while-revalidate）経由で、
+TTL 切れでもシートの最終更新日時が変わっていなければ全件は取り直さない。
+変わっていた場合も、出品は末尾への追加だけなので、既知の行数より後ろの
+新しい行（A〜P）と、既存行の変わりうる列（M〜P）だけを取る差分同期を行う。
+手作業の編集を拾うため、FULL_SYNC_INTERVAL ごとに全件を取り直す。
+
+ステータスの変更は transition() で行う。その行の A 列と M〜P 列だけを
+読んで遷移元ステータスを確かめてから書き込み、同じ商品への遷移は
+プロセス内で直列化するので、同時に「購入する」を押しても二重売買にならない。
+
+急がない書き込み（取下げ・再出品・出品内容の修正）は stage() でキャッシュに
+だけ先に反映して保留にし、flush_pending() でまとめて1回の batch_update で
+シートに書く（ジャーナルと定期実行は utils.write_behind）。保留した
+ステータスの変更は遷移元ステータスも覚えておき、書き出す時点でシートの
+ステータスが変わっていたら（事務局の手作業・別プロセス）書かずに捨てる。
+"""
+import logging
+import re
+import threading
+import time
+
+import streamlit as st
+from gspread.utils import numericise_all
+
+from utils.sheet_cache import SnapshotCache
+from utils.sheet_client import get_connection
+
+logger = logging.getLogger(__name__)
+
+# 商品シートの列（A〜P）
+COLUMNS = [
+    "商品ID", "商品名", "価格", "説明", "状態",
+    "画像URL", "画像URLサブ1", "画像URLサブ2",
+    "出品者", "出品者名", "投稿日時", "カテゴリ",
+    "購入者", "購入者名", "購入日時", "ステータス",
+]
+LAST_COLUMN = "P"
+
+# 購入・支払いで変わる列（M〜P）
+PURCHASE_COLUMNS = ["購入者", "購入者名", "購入日時", "ステータス"]
+
+# スナップショットの有効期間（秒）
+DEFAULT_TTL = 30
+
+# 差分同期を続けていても、この間隔（秒）で全件を取り直す
+FULL_SYNC_INTERVAL = 600
+
+# append_row の応答 "シート1!A57:P57" から行番号を取り出す
+_UPDATED_ROW_RE = re.compile(r"![A-Z]+(\d+)")
+
+
+def _appended_row_number(result):
+    try:
+        updated_range = result["updates"]["updatedRange"]
+    except (TypeError, KeyError):
+        return None
+    m = _UPDATED_ROW_RE.search(updated_range)
+    return int(m.group(1)) if m else None
+
+
+def _column_letter(column):
+    return chr(ord("A") + COLUMNS.index(column))
+
+
+def _to_record(columns, values):
+    """batch_get の1行を get_all_records と同じ形の dict にする"""
+    values = list(values) + [""] * (len(columns) - len(values))
+    return dict(zip(columns, numericise_all(values[:len(columns)])))
+
+
+def _field_ranges(row_num, fields):
+    """1行分の変更を、連続した列ごとの batch_update 用の範囲にまとめる"""
+    positions = sorted(COLUMNS.index(c) for c in fields)
+    groups = []
+    for pos in positions:
+        if groups and pos == groups[-1][-1] + 1:
+            groups[-1].append(pos)
+        else:
+            groups.append([pos])
+    return [
+        {
+            "range": f"{_column_letter(COLUMNS[g[0]])}{row_num}:{_column_letter(COLUMNS[g[-1]])}{row_num}",
+            "values": [[fields[COLUMNS[pos]] for pos in g]],
+        }
+        for g in groups
+    ]
+
+
+def _norm_id(value):
+    return str(value if value is not None else "").strip()
+
+
+class _Snapshot:
+    """ある時点の全行と、その行に対する索引一式
+
+    索引の値（行番号リスト）は書き換えずに差し替えるので、ロック内で
+    取り出したリストはそのまま使ってよい。
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.by_id = {}
+        self.by_seller = {}
+        self.by_buyer = {}
+        self.buyer_status = {}
+        # 作るときはまだ誰にも渡していないので、リストにそのまま追加してよい
+        for i, row in enumerate(self.rows):
+            row_num = i + 2
+            self.by_id[str(row.get("商品ID"))] = row_num
+            self.by_seller.setdefault(_norm_id(row.get("出品者")), []).append(row_num)
+            buyer = _norm_id(row.get("購入者"))
+            if buyer:
+                self.by_buyer.setdefault(buyer, []).append(row_num)
+                key = (buyer, row.get("ステータス"))
+                self.buyer_status[key] = self.buyer_status.get(key, 0) + 1
+
+    def _add(self, row_num, row):
+        # 渡したリストを書き換えないよう、差し替えで追加する
+        self.by_id[str(row.get("商品ID"))] = row_num
+        seller = _norm_id(row.get("出品者"))
+        self.by_seller[seller] = self.by_seller.get(seller, []) + [row_num]
+        buyer = _norm_id(row.get("購入者"))
+        if buyer:
+            self.by_buyer[buyer] = self.by_buyer.get(buyer, []) + [row_num]
+            key = (buyer, row.get("ステータス"))
+            self.buyer_status[key] = self.buyer_status.get(key, 0) + 1
+
+    def _remove(self, row_num, row):
+        seller = _norm_id(row.get("出品者"))
+        self.by_seller[seller] = [n for n in self.by_seller.get(seller, []) if n != row_num]
+        buyer = _norm_id(row.get("購入者"))
+        if buyer:
+            self.by_buyer[buyer] = [n for n in self.by_buyer.get(buyer, []) if n != row_num]
+            key = (buyer, row.get("ステータス"))
+            self.buyer_status[key] = self.buyer_status.get(key, 0) - 1
+
+    def has_row(self, row_num):
+        return 0 <= row_num - 2 < len(self.rows)
+
+    def replace(self, row_num, row):
+        self._remove(row_num, self.rows[row_num - 2])
+        self.rows[row_num - 2] = row
+        self._add(row_num, row)
+
+    def append(self, row):
+        self.rows.append(row)
+        self._add(len(self.rows) + 1, row)
+
+    def select(self, row_nums):
+        return [self.rows[n - 2] for n in row_nums]
+
+
+class ProductCatalog:
+    """商品シートのスナップショットと書き込み窓口
+
+    sheet は商品ワークシートを返す関数。裏のスレッドからも呼ばれるので
+    st.* には触れないものを渡す。
+    """
+
+    def __init__(self, sheet, ttl=DEFAULT_TTL):
+        self._sheet = sheet
+        self._cache = SnapshotCache(
+            self._load, ttl,
+            on_loaded=self._replay_writes,
+            version=lambda: self._sheet().last_modified(),
+        )
+        self._lock = self._cache.lock
+        # 取得中に行われた書き込みを取得後に当て直すため、完了時刻付きで残す
+        self._writes = []
+        self._row_locks = {}
+        self._last_full_sync = float("-inf")
+        self._listeners = []
+        # 後書き待ちの変更（商品ID → {列: 値}）
+        self._pending = {}
+        # 後書き待ちのステータス変更の遷移元（商品ID → 書き出し時にシートにあるはずの値）
+        self._expected = {}
+        # スナップショットの中身が変わるたびに増える（検索索引の作り直しの判断用）
+        self._version = 0
+
+    # ============================================
+    # 📄 読み込み
+    # ============================================
+    def _load(self, previous=None):
+        now = time.monotonic()
+        if previous is not None and previous.rows and now - self._last_full_sync < FULL_SYNC_INTERVAL:
+            with self._lock:
+                rows = list(previous.rows)
+            if self._sync_incremental(rows):
+                return _Snapshot(rows)
+        self._last_full_sync = now
+        return _Snapshot(self._sheet().get_all_records())
+
+    def _sync_incremental(self, rows):
+        """rows に新しい行を足し、既存行の M〜P 列を最新にする
+
+        既存行の商品IDも同じリクエストで読み、行の削除・挿入・並び替えで
+        1行でもずれていれば False を返して全件取得に任せる。
+        """
+        known = len(rows)
+        new_rows, ids, states = self._sheet().batch_get(
+            [f"A{known + 2}:{LAST_COLUMN}", f"A2:A{known + 1}", f"M2:{LAST_COLUMN}{known + 1}"]
+        )
+        # 既存行はステータスが必ず入っているので、足りなければ行が減っている
+        if len(states) < known or len(ids) < known:
+            return False
+        for row, values in zip(rows, ids):
+            if not values or str(values[0]) != str(row.get("商品ID")):
+                return False
+        for i, values in enumerate(states):
+            fields = _to_record(PURCHASE_COLUMNS, values)
+            if any(rows[i].get(k) != v for k, v in fields.items()):
+                rows[i] = {**rows[i], **fields}
+        rows.extend(_to_record(COLUMNS, values) for values in new_rows)
+        return True
+
+    def _replay_writes(self, snap, started):
+        """取得開始後に完了した書き込みを新しいスナップショットに当て直す"""
+        self._version += 1
+        self._writes = [w for w in self._writes if w[0] >= started]
+        for _, row_num, fields, appended in self._writes:
+            if appended:
+                if str(fields["商品ID"]) not in snap.by_id and row_num == len(snap.rows) + 2:
+                    snap.append(fields)
+            elif snap.has_row(row_num):
+                snap.replace(row_num, {**snap.rows[row_num - 2], **fields})
+        # まだシートに書いていない変更も当て直す
+        for product_id, fields in self._pending.items():
+            row_num = snap.by_id.get(product_id)
+            if row_num is not None and snap.has_row(row_num):
+                snap.replace(row_num, {**snap.rows[row_num - 2], **fields})
+
+    def invalidate(self):
+        self._cache.invalidate()
+
+    def _snapshot(self, force=False):
+        return self._cache.get(force)
+
+    def records(self, force=False):
+        """全商品（シートの行順）。呼び出し側で並び替えてよいようコピーを返す"""
+        snap = self._snapshot(force)
+        with self._lock:
+            return list(snap.rows)
+
+    def listed_products(self):
+        """商品検索に出す商品（必須項目がそろい、取下げでないもの）"""
+        return [
+            row for row in self.records()
+            if row.get("商品名") and row.get("価格") and row.get("画像URL")
+            and row.get("ステータス") != "取下げ"
+        ]
+
+    def by_buyer(self, user_id):
+        """購入者IDの商品（シートの行順）"""
+        snap = self._snapshot()
+        with self._lock:
+            return snap.select(snap.by_buyer.get(_norm_id(user_id), []))
+
+    def by_seller(self, user_id):
+        """出品者IDの商品（シートの行順）"""
+        snap = self._snapshot()
+        with self._lock:
+            return snap.select(snap.by_seller.get(_norm_id(user_id), []))
+
+    def count_by_buyer_status(self, user_id, status):
+        snap = self._snapshot()
+        with self._lock:
+            return snap.buyer_status.get((_norm_id(user_id), status), 0)
+
+    def _lookup(self, product_id, force=False):
+        snap = self._snapshot(force)
+        with self._lock:
+            row_num = snap.by_id.get(str(product_id))
+            if row_num is None or not snap.has_row(row_num):
+                return None, None
+            return row_num, snap.rows[row_num - 2]
+
+    def find(self, product_id):
+        row_num, row = self._lookup(product_id)
+        if row_num is None:
+            row_num, row = self._lookup(product_id, force=True)
+        return row
+
+    def _verify(self, row_num, product_id):
+        """A列の1セルだけを読み、索引の行に本当にその商品があるか確かめる"""
+        return str(self._sheet().cell(row_num, 1).value) == str(product_id)
+
+    def row_number(self, product_id, verify=True):
+        """商品IDのシート上の行番号
+
+        索引から引き、verify=True なら A 列の1セルで確認する。見つからない・
+        ずれている（シートが手作業で並び替えられた等）場合だけ全件を取り直す。
+        """
+        row_num, _ = self._lookup(product_id)
+        if row_num is not None and (not verify or self._verify(row_num, product_id)):
+            return row_num
+        row_num, _ = self._lookup(product_id, force=True)
+        return row_num
+
+    # ============================================
+    # 🔁 ステータス遷移（compare-and-set）
+    # ============================================
+    def _row_lock(self, product_id):
+        with self._lock:
+            return self._row_locks.setdefault(str(product_id), threading.Lock())
+
+    def _read_state(self, row_num):
+        """A列（商品ID）と M〜P 列だけを1リクエストで読む"""
+        id_range, state_range = self._sheet().batch_get(
+            [f"A{row_num}", f"M{row_num}:{LAST_COLUMN}{row_num}"]
+        )
+        current_id = id_range[0][0] if id_range and id_range[0] else ""
+        values = list(state_range[0]) if state_range else []
+        values += [""] * (len(PURCHASE_COLUMNS) - len(values))
+        return current_id, dict(zip(PURCHASE_COLUMNS, values))
+
+    def transition(self, product_id, from_status, to_status, fields=None, retries=3):
+        """ステータスが from_status のままなら to_status に変える
+
+        fields には同時に書き込む M〜P 列の値を渡す。成功なら True、
+        ステータスが既に変わっていれば False、商品が無ければ None を返す。
+        行が動いていた（手作業の並び替え等）場合は索引を取り直して再試行する。
+        """
+        with self._row_lock(product_id):
+            for attempt in range(retries):
+                row_num, _ = self._lookup(product_id, force=attempt > 0)
+                if row_num is None:
+                    return None
+                current_id, state = self._read_state(row_num)
+                if str(current_id) != str(product_id):
+                    continue
+                # 後書き待ちの変更があればそちらが最新
+                with self._lock:
+                    pending = self._pending.get(str(product_id), {})
+                    state = {**state, **{c: pending[c] for c in PURCHASE_COLUMNS if c in pending}}
+                # 読んだ値でスナップショットを最新にしてから判定する
+                self._patch_if_changed(row_num, state)
+                if state["ステータス"] != from_status:
+                    return False
+                written = {**(fields or {}), "ステータス": to_status}
+                self.update_fields(row_num, written)
+                self._drop_pending(product_id, written)
+                return True
+        return None
+
+    # ============================================
+    # ⏳ 後書き（write-behind）
+    # ============================================
+    def stage(self, product_id, fields, from_status=None):
+        """シートへの書き込みを保留にし、キャッシュにだけ先に反映する
+
+        from_status はステータスを変えるときの遷移元。同じ商品で遷移を重ねても
+        シートと比べるのは最初の遷移元（まだシートに書いていないので）。
+        """
+        product_id = str(product_id)
+        with self._lock:
+            if from_status is not None and "ステータス" in fields:
+                self._expected.setdefault(product_id, from_status)
+            self._pending[product_id] = {**self._pending.get(product_id, {}), **fields}
+            snap = self._cache.peek()
+            row_num = snap.by_id.get(product_id) if snap is not None else None
+            if row_num is not None and snap.has_row(row_num):
+                snap.replace(row_num, {**snap.rows[row_num - 2], **fields})
+        if row_num is not None:
+            self._notify(row_num, fields)
+
+    def pending_changes(self):
+        with self._lock:
+            return {pid: dict(fields) for pid, fields in self._pending.items()}
+
+    def expected_statuses(self):
+        """後書き待ちのステータス変更の遷移元（商品ID → ステータス）"""
+        with self._lock:
+            return dict(self._expected)
+
+    def _forget_pending(self, product_id, columns):
+        """保留分から columns を取り除く（lock の中で呼ぶ）"""
+        pending = self._pending.get(product_id)
+        if pending is None:
+            return
+        for column in columns:
+            pending.pop(column, None)
+        if "ステータス" not in pending:
+            self._expected.pop(product_id, None)
+        if not pending:
+            del self._pending[product_id]
+
+    def _drop_pending(self, product_id, fields):
+        """書き込み済みの値と同じ保留分を取り除く（同じ列の上書き分は捨てる）"""
+        with self._lock:
+            self._forget_pending(str(product_id), fields)
+
+    def transition_local(self, product_id, from_status, to_status):
+        """キャッシュ上のステータスで判定し、書き込みは保留にする
+
+        戻り値は transition() と同じ。シートへは flush_pending() で書かれる。
+        """
+        with self._row_lock(product_id):
+            row = self.find(product_id)
+            if row is None:
+                return None
+            if row.get("ステータス") != from_status:
+                return False
+            self.stage(product_id, {"ステータス": to_status}, from_status)
+            return True
+
+    def flush_pending(self):
+        """保留中の変更をまとめて1回の batch_update でシートに書く
+
+        書く前に対象行の A 列（商品ID）と P 列（ステータス）を読み、行が
+        ずれていた商品は次回に回す。ステータスが遷移元から変わっていた
+        商品は、ステータスを書かずに保留から捨ててシートの値に合わせる。
+        """
+        product_ids = sorted(self.pending_changes())
+        if not product_ids:
+            return
+        # 書いている間に同じ商品の購入・取下げが割り込まないよう行ロックを取る
+        locks = [self._row_lock(pid) for pid in product_ids]
+        for lock in locks:
+            lock.acquire()
+        try:
+            pending = {pid: f for pid, f in self.pending_changes().items() if pid in product_ids}
+            expected = self.expected_statuses()
+            rows = {pid: self._lookup(pid)[0] for pid in pending}
+            targets = [(pid, r) for pid, r in rows.items() if r is not None]
+            found = self._sheet().batch_get(
+                [cell for _, r in targets for cell in (f"A{r}", f"{LAST_COLUMN}{r}")]
+            ) if targets else []
+
+            data = []
+            written = {}
+            conflicts = {}
+            for i, (pid, r) in enumerate(targets):
+                current_id, status = found[2 * i], found[2 * i + 1]
+                if not current_id or not current_id[0] or str(current_id[0][0]) != pid:
+                    # 行がずれている。索引を取り直して次回書く
+                    self._lookup(pid, force=True)
+                    continue
+                fields = dict(pending[pid])
+                sheet_status = status[0][0] if status and status[0] else ""
+                if "ステータス" in fields and pid in expected and sheet_status != expected[pid]:
+                    conflicts[pid] = (r, sheet_status)
+                    fields.pop("ステータス")
+                if fields:
+                    data.extend(_field_ranges(r, fields))
+                    written[pid] = (r, fields)
+            if data:
+                self._sheet().batch_update(data)
+
+            with self._lock:
+                for pid, (r, fields) in written.items():
+                    self._writes.append((time.monotonic(), r, fields, False))
+                    # 書いている間に変わった列は残して次回に回す
+                    current = self._pending.get(pid, {})
+                    self._forget_pending(pid, [c for c, v in fields.items() if current.get(c) == v])
+                    if "ステータス" in fields and pid in self._expected:
+                        # シートは書いた値になったので、残った遷移はそこから比べる
+                        self._expected[pid] = fields["ステータス"]
+                for pid in conflicts:
+                    self._forget_pending(pid, ["ステータス"])
+            for pid, (r, sheet_status) in conflicts.items():
+                logger.warning(
+                    "商品 %s のステータスが %s から %s に変わっていたため、%s への変更を書かずに捨てました",
+                    pid, expected[pid], sheet_status, pending[pid]["ステータス"],
+                )
+                self._patch(r, {"ステータス": sheet_status})
+        finally:
+            for lock in locks:
+                lock.release()
+
+    # ============================================
+    # ✏ 書き込み（シートへ反映後にスナップショットを更新）
+    # ============================================
+    def subscribe(self, listener):
+        """書き込みのたびに listener(row_num, fields, appended) を呼ぶ"""
+        self._listeners.append(listener)
+
+    def version(self):
+        """スナップショットの版（読み込み・書き込みのたびに変わる）
+
+        版だけを見る呼び出し側（検索索引）でも TTL 切れの読み直しが
+        始まるよう、スナップショットを取ってから返す。
+        """
+        self._snapshot()
+        with self._lock:
+            return self._version
+
+    def _notify(self, row_num, fields, appended=False):
+        with self._lock:
+            self._version += 1
+        for listener in self._listeners:
+            try:
+                listener(row_num, fields, appended)
+            except Exception:
+                pass
+
+    def _patch(self, row_num, fields):
+        with self._lock:
+            self._writes.append((time.monotonic(), row_num, fields, False))
+            snap = self._cache.peek()
+            if snap is None or not snap.has_row(row_num):
+                self._cache.invalidate()
+            else:
+                # 行の dict は書き換えず新しい dict に差し替える
+                snap.replace(row_num, {**snap.rows[row_num - 2], **fields})
+        self._notify(row_num, fields)
+
+    def _patch_if_changed(self, row_num, fields):
+        """スナップショットと違う値があるときだけ _patch する（版を無駄に進めない）
+
+        シートから読んだ値は文字列、get_all_records の値は数値のことがあるので
+        文字列にして比べる。
+        """
+        with self._lock:
+            snap = self._cache.peek()
+            if snap is not None and snap.has_row(row_num):
+                current = snap.rows[row_num - 2]
+                if all(str(current.get(c, "")) == str(v) for c, v in fields.items()):
+                    return
+        self._patch(row_num, fields)
+
+    def update_fields(self, row_num, fields):
+        """複数列をまとめて1回の範囲更新で書き込む
+
+        指定列が飛び飛びの場合、間の列はスナップショットの値で埋める。
+        """
+        positions = sorted(COLUMNS.index(c) for c in fields)
+        columns = COLUMNS[positions[0]:positions[-1] + 1]
+        with self._lock:
+            snap = self._cache.peek()
+            current = snap.rows[row_num - 2] if snap is not None and snap.has_row(row_num) else {}
+        if any(c not in fields and c not in current for c in columns):
+            raise KeyError(f"{row_num}行目の現在値が分からないため範囲更新できません")
+        values = [fields[c] if c in fields else current[c] for c in columns]
+        try:
+            self._sheet().update(
+                range_name=f"{_column_letter(columns[0])}{row_num}:{_column_letter(columns[-1])}{row_num}",
+                values=[values],
+            )
+        except Exception:
+            self.invalidate()
+            raise
+        self._patch(row_num, dict(zip(columns, values)))
+
+    def append_row(self, values):
+        try:
+            result = self._sheet().append_row(values)
+        except Exception:
+            self.invalidate()
+            raise
+        row_num = _appended_row_number(result)
+        row = dict(zip(COLUMNS, values))
+        with self._lock:
+            self._writes.append((time.monotonic(), row_num, row, True))
+            snap = self._cache.peek()
+            if snap is not None and row_num == len(snap.rows) + 2:
+                snap.append(row)
+            else:
+                # 追加位置が分からなければ次回読み込みで取り直す
+                self._cache.invalidate()
+        if row_num is not None:
+            self._notify(row_num, row, appended=True)
+        return row_num
+
+
+@st.cache_resource
+def get_catalog():
+    connection = get_connection()
+    name = st.secrets["PRODUCT_SHEET_NAME"]
+    key = st.secrets.get("PRODUCT_SHEET_KEY")
+    return ProductCatalog(
+        lambda: connection.worksheet(name, key),
+        ttl=float(st.secrets.get("PRODUCT_CACHE_TTL", DEFAULT_TTL)),
+    )
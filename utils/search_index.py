@@ -0,0 +1,343 @@
+"""商品検索の全文索引
+
+商品検索は入力のたびに全商品の商品名を部分一致で調べていたため、商品が
+増えるほど遅くなり、「ｼｬﾂ」「シャツ」「しゃつ」のような全角・半角や
+ひらがな・カタカナの違いでも見つからなかった。
+
+SearchIndex は 商品名 と 説明 を正規化（NFKC・小文字化・カタカナ→ひらがな）
+した文字列の 1〜2 文字の n-gram 転置索引を持ち、検索語の n-gram の
+ポスティングリストの積集合から候補を絞ってから部分一致を確かめる。
+商品データが変わったときは、追加・変更・削除された商品の分だけ
+索引を更新する。
+
+並び替えも入力のたびに投稿日時を strptime し直していたので、商品データの
+版ごとに CatalogView を作り、数値の価格・解析済みの投稿日時と、
+新着順・価格順の並び順（行番号の順列）を前もって持っておく。
+
+絞り込みは列ごとの配列（カテゴリ・状態・ステータスはカテゴリコード）を
+候補の位置で引いて判定し、条件を1つ掛けるごとに候補を減らしていく。
+表示する 1 ページ分の行だけを dict のリストとして取り出す。
+
+カテゴリ・状態・出品ステータスの選択肢に付ける件数（ファセット）は、
+それぞれ「自分以外の絞り込みを掛けた集合」をコード配列で一度数えて
+求め、CatalogView ごとに絞り込み条件をキーにしてキャッシュする。
+
+価格帯の絞り込みは、価格順に並べた価格の配列を二分探索して範囲に入る
+k 件の位置を取り出し、他の絞り込みはその k 件にだけ掛ける（価格順なら
+O(log n + k)、新着順は k 件を並べ直す分の O(k log k) が加わる）。
+ファセットの件数も同じ k 件から数える。
+"""
+import threading
+import unicodedata
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+SEARCH_COLUMNS = ["商品名", "説明"]
+
+SORT_OPTIONS = ["新着順", "価格が安い順", "価格が高い順"]
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# カテゴリコードで持つ絞り込み用の列
+FILTER_COLUMNS = ["カテゴリ", "状態", "ステータス"]
+
+ALL = "すべて"
+# 出品ステータスの選択肢 → (ステータスの値, 含める / 除く)
+STATUS_OPTIONS = {
+    ALL: None,
+    "出品中のみ": (["出品中"], True),
+    "売却済": (["出品中", "取下げ"], False),
+}
+FACET_CACHE_SIZE = 256
+
+# カタカナ（ァ〜ヶ）→ ひらがな
+_KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def normalize(text):
+    """検索用の正規化（全角半角・大文字小文字・ひらがなカタカナを同一視）"""
+    return unicodedata.normalize("NFKC", str(text)).lower().translate(_KANA_FOLD)
+
+
+def parse_price(value):
+    """シートの価格（数値・文字列どちらもある）を整数にする。読めなければ 0"""
+    try:
+        return int(float(str(value).replace(",", "")))
+    except ValueError:
+        return 0
+
+
+def parse_posted(value):
+    """投稿日時を datetime にする。読めなければ datetime.min（新着順で最後）"""
+    try:
+        return datetime.strptime(str(value), DATETIME_FORMAT)
+    except ValueError:
+        return datetime.min
+
+
+def _grams(text):
+    """text に含まれる 1 文字・2 文字の n-gram（空白をまたがない）"""
+    grams = set()
+    for word in text.split():
+        grams.update(word)
+        grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+def _query_grams(term):
+    """検索語の候補絞り込みに使う n-gram（2 文字以上なら 2-gram だけ）"""
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+class SearchIndex:
+    """商品ID → 正規化済みテキストと、n-gram → 商品ID 集合の転置索引"""
+
+    def __init__(self):
+        self._texts = {}
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _add(self, product_id, text):
+        self._texts[product_id] = text
+        for gram in _grams(text):
+            self._postings.setdefault(gram, set()).add(product_id)
+
+    def _remove(self, product_id):
+        text = self._texts.pop(product_id)
+        for gram in _grams(text):
+            posting = self._postings[gram]
+            posting.discard(product_id)
+            if not posting:
+                del self._postings[gram]
+
+    def update(self, rows):
+        """rows（商品の行）に合わせて、変わった商品の分だけ索引を更新する"""
+        texts = {
+            str(row.get("商品ID")): normalize(" ".join(str(row.get(c, "")) for c in SEARCH_COLUMNS))
+            for row in rows
+        }
+        for product_id in [pid for pid in self._texts if texts.get(pid) != self._texts[pid]]:
+            self._remove(product_id)
+        for product_id, text in texts.items():
+            if product_id not in self._texts:
+                self._add(product_id, text)
+
+    def search(self, query):
+        """検索語（空白区切りは AND）を全て含む商品IDの集合"""
+        result = None
+        for term in normalize(query).split():
+            postings = [self._postings.get(gram, set()) for gram in _query_grams(term)]
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            # n-gram が全部あっても並びが違うことがあるので部分一致を確かめる
+            matched = {pid for pid in candidates if term in self._texts[pid]}
+            result = matched if result is None else result & matched
+            if not result:
+                return set()
+        return result if result is not None else set(self._texts)
+
+
+def _descending(keys):
+    """keys の降順の順列（同じ値どうしは元の順を保つ）"""
+    return np.argsort(-keys, kind="stable")
+
+
+class CatalogView:
+    """ある版の商品一覧の列ごとの配列と、前もって並べた順序
+
+    位置（0 始まり）は rows の添字。絞り込み条件は「位置の配列を受け取り、
+    それぞれが条件に合うかの真偽値配列を返す関数」で、候補の位置にだけ
+    掛ける。
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.positions = {str(row.get("商品ID")): i for i, row in enumerate(rows)}
+        self.prices = np.array([parse_price(row.get("価格")) for row in rows], dtype=np.int64)
+        self.posted = np.array(
+            [(parse_posted(row.get("投稿日時")) - datetime.min).total_seconds() for row in rows],
+            dtype=np.float64,
+        )
+        self.codes = {}
+        self.categories = {}
+        for column in FILTER_COLUMNS:
+            values = pd.Categorical([str(row.get(column, "")) for row in rows])
+            self.codes[column] = values.codes
+            self.categories[column] = list(values.categories)
+        self._facets = {}
+        self._facets_lock = threading.Lock()
+        self.orders = {
+            "新着順": _descending(self.posted),
+            "価格が安い順": np.argsort(self.prices, kind="stable"),
+            "価格が高い順": _descending(self.prices),
+        }
+        # 位置 → 並び順での順位（価格帯で切り出した候補を並べ直す用）
+        self._ranks = {}
+        for option, order in self.orders.items():
+            rank = np.empty(len(rows), dtype=np.int64)
+            rank[order] = np.arange(len(rows))
+            self._ranks[option] = rank
+        # 価格順の並びに沿った昇順のキー（二分探索用）。高い順は符号を反転する
+        self._price_keys = {
+            "価格が安い順": (self.prices[self.orders["価格が安い順"]], 1),
+            "価格が高い順": (-self.prices[self.orders["価格が高い順"]], -1),
+        }
+
+    def __len__(self):
+        return len(self.rows)
+
+    def match(self, column, values):
+        """column の値が values のどれかである位置を判定する関数"""
+        categories = self.categories[column]
+        codes = [categories.index(v) for v in values if v in categories]
+        return lambda positions: np.isin(self.codes[column][positions], codes)
+
+    def match_ids(self, product_ids):
+        """商品IDが product_ids に含まれる位置を判定する関数"""
+        matched = np.array(
+            sorted(self.positions[pid] for pid in product_ids if pid in self.positions), dtype=np.int64
+        )
+        return lambda positions: np.isin(positions, matched, assume_unique=True)
+
+    def price_bounds(self):
+        """(最安値, 最高値)。商品が無ければ (0, 0)"""
+        keys = self._price_keys["価格が安い順"][0]
+        if not len(keys):
+            return 0, 0
+        return int(keys[0]), int(keys[-1])
+
+    def _price_slice(self, sort_option, price_range):
+        """価格順の並び順のうち、価格が price_range（両端を含む）に入る区間"""
+        keys, sign = self._price_keys[sort_option]
+        lo, hi = sorted((sign * price_range[0], sign * price_range[1]))
+        start = np.searchsorted(keys, lo, side="left")
+        end = np.searchsorted(keys, hi, side="right")
+        return self.orders[sort_option][start:end]
+
+    def status_filter(self, option):
+        """出品ステータスの選択肢に合う位置を判定する関数"""
+        values, include = STATUS_OPTIONS[option]
+        matched = self.match("ステータス", values)
+        return matched if include else lambda positions: ~matched(positions)
+
+    def filters(self, search_ids, category, condition, status_option):
+        """価格帯以外の絞り込み条件（条件の無いものは含めない）"""
+        filters = {}
+        if search_ids is not None:
+            filters["検索"] = self.match_ids(search_ids)
+        if category != ALL:
+            filters["カテゴリ"] = self.match("カテゴリ", [category])
+        if condition != ALL:
+            filters["状態"] = self.match("状態", [condition])
+        if status_option != ALL:
+            filters["ステータス"] = self.status_filter(status_option)
+        return filters
+
+    def apply(self, filters, positions, skip=None):
+        """positions のうち filters（skip 以外）に全て合うものを、順序を保って返す"""
+        for name, keep in filters.items():
+            if name != skip and len(positions):
+                positions = positions[keep(positions)]
+        return positions
+
+    def candidates(self, sort_option, price_range=None):
+        """sort_option の順に並べた候補の位置（価格帯があればその範囲だけ）
+
+        価格帯は価格順の並びを二分探索して切り出すので、全件は見ない。
+        新着順なら切り出した k 件を順位で並べ直す。
+        """
+        if price_range is None:
+            return self.orders[sort_option]
+        if sort_option in self._price_keys:
+            return self._price_slice(sort_option, price_range)
+        positions = self._price_slice("価格が安い順", price_range)
+        return positions[np.argsort(self._ranks[sort_option][positions], kind="stable")]
+
+    def facets(self, key, filters, price_range=None):
+        """選択肢ごとの件数。各列は自分以外の絞り込みを掛けた集合で数える
+
+        key は絞り込み条件を表す値（filters と price_range の元になったもの）で、
+        同じ key の結果はこの版のあいだキャッシュする。
+        """
+        with self._facets_lock:
+            cached = self._facets.get(key)
+        if cached is not None:
+            return cached
+
+        # 件数は並び順に関係ないので、価格帯の候補（無ければ全件）から数える
+        if price_range is None:
+            positions = np.arange(len(self.rows))
+        else:
+            positions = self._price_slice("価格が安い順", price_range)
+        result = {}
+        for column in ["カテゴリ", "状態"]:
+            base = self.apply(filters, positions, skip=column)
+            counts = np.bincount(self.codes[column][base], minlength=len(self.categories[column]))
+            result[column] = {ALL: len(base), **dict(zip(self.categories[column], counts.tolist()))}
+        base = self.apply(filters, positions, skip="ステータス")
+        counts = dict(zip(
+            self.categories["ステータス"],
+            np.bincount(self.codes["ステータス"][base], minlength=len(self.categories["ステータス"])).tolist(),
+        ))
+        total = len(base)
+        result["ステータス"] = {}
+        for option, spec in STATUS_OPTIONS.items():
+            if spec is None:
+                result["ステータス"][option] = total
+            else:
+                values, include = spec
+                n = sum(counts.get(v, 0) for v in values)
+                result["ステータス"][option] = n if include else total - n
+
+        with self._facets_lock:
+            if len(self._facets) >= FACET_CACHE_SIZE:
+                self._facets.clear()
+            self._facets[key] = result
+        return result
+
+    def select(self, filters, sort_option, price_range=None):
+        """絞り込みに合う行の位置を sort_option の順に返す
+
+        価格帯があれば候補をその範囲に切り出してから、残りの条件を
+        候補の位置にだけ掛ける。
+        """
+        return self.apply(filters, self.candidates(sort_option, price_range))
+
+    def take(self, positions):
+        return [self.rows[i] for i in positions]
+
+
+class ProductSearch:
+    """全セッションで共有する検索用のデータ（商品データの版ごとに更新）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self.view = CatalogView([])
+        self.index = SearchIndex()
+
+    def refresh(self, storage):
+        """商品データが変わっていれば読み直して索引と CatalogView を作り直す"""
+        version = storage.version()
+        with self._lock:
+            if version != self._version:
+                rows = storage.listed_products()
+                self.index.update(rows)
+                self.view = CatalogView(rows)
+                self._version = version
+            return self.view
+
+    def search(self, query):
+        with self._lock:
+            return self.index.search(query)
+
+
+@st.cache_resource
+def get_product_search():
+    return ProductSearch()
@@ -0,0 +1,127 @@
+"""シートのスナップショットキャッシュ
+
+案内メール直後などに大勢が一斉に商品検索を開くと、各セッションが同じ
+シートを並行して取得してしまう。SnapshotCache は
+
+- キャッシュが無いときの取得を single-flight にし、1スレッドだけが取得して
+  他のセッションはその結果を待つ
+- TTL 切れのときは古いスナップショットをすぐ返し、裏のスレッドで取り直す
+  （stale-while-revalidate）
+
+ことで、アクセスが集中してもページの待ち時間を一定に保つ。
+
+version を渡すと、TTL 切れの取り直しの前にまずそれ（Drive の最終更新日時
+など、全件取得よりずっと軽いもの）を確かめ、変わっていなければ全件取得を
+省いて今のスナップショットを延長する。
+"""
+import threading
+import time
+
+from utils.sheet_scheduler import SingleFlight
+
+
+class SnapshotCache:
+    """load() の結果を ttl 秒キャッシュする
+
+    load(previous) は新しい値を返す。previous は TTL 切れの取り直しでは
+    今の値、初回・強制取得では None（差分取得できるかの判断に使う）。
+    on_loaded(value, started) は取得した値を保存する直前に lock の中で
+    呼ばれる。取得中に行われた書き込みを反映し直すのに使う。
+    version() はデータの版を表す値を返す軽い関数（省略可）。
+    """
+
+    def __init__(self, load, ttl, on_loaded=None, version=None):
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._load = load
+        self._on_loaded = on_loaded
+        self._version_of = version
+        self._value = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._revalidating = False
+        self._flight = SingleFlight()
+
+    def _fetch(self):
+        return self._flight.do("load", self._load_and_store)
+
+    def _revalidate(self):
+        return self._flight.do("revalidate", lambda: self._load_and_store(check_version=True))
+
+    def _current_version(self):
+        if self._version_of is None:
+            return None
+        try:
+            return self._version_of()
+        except Exception:
+            # 版が取れなければ全件取得に任せる
+            return None
+
+    def _load_and_store(self, check_version=False):
+        with self.lock:
+            generation = self._generation
+            known_version = self._version
+            previous = self._value if check_version else None
+        started = time.monotonic()
+        # 全件取得の前に版を取る（取得中の変更は次回の確認で拾える）
+        version = self._current_version()
+
+        if check_version and version is not None and version == known_version:
+            with self.lock:
+                if generation == self._generation and self._value is not None:
+                    self._loaded_at = started
+                    return self._value
+
+        value = self._load(previous)
+        with self.lock:
+            if self._on_loaded:
+                self._on_loaded(value, started)
+            self._value = value
+            # 取得中に invalidate されていたら、次の読み込みで取り直させる
+            if generation == self._generation:
+                self._loaded_at = started
+                self._version = version
+            else:
+                self._loaded_at = float("-inf")
+                self._version = None
+        return value
+
+    def _revalidate_in_background(self):
+        with self.lock:
+            if self._revalidating:
+                return
+            self._revalidating = True
+
+        def run():
+            try:
+                self._revalidate()
+            except Exception:
+                # 取り直しに失敗しても古いスナップショットで返し続ける
+                pass
+            finally:
+                with self.lock:
+                    self._revalidating = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get(self, force=False):
+        with self.lock:
+            value = self._value
+            stale = time.monotonic() - self._loaded_at >= self.ttl
+        if value is None or force:
+            return self._fetch()
+        if stale:
+            self._revalidate_in_background()
+        return value
+
+    def peek(self):
+        """読み込みを起こさずに今のスナップショットを返す（無ければ None）"""
+        with self.lock:
+            return self._value
+
+    def invalidate(self):
+        with self.lock:
+            self._value = None
+            self._version = None
+            self._generation += 1
@@ -0,0 +1,132 @@
+"""Google Sheets 接続の共通モジュール
+
+各ページで毎回 OAuth 認証と gspread.authorize を行うと、再実行のたびに
+トークン取得と TLS ハンドシェイクが発生する。ここではプロセス全体で
+1つの認証済みクライアント（HTTP セッション）を保持し、ワークシートの
+ハンドルもキャッシュして全ページで使い回す。
+
+gc.open(名前) は毎回 Drive のタイトル検索になるため、名前 → スプレッド
+シートID の解決は一度だけ行い、以降は open_by_key で開く。
+
+API 呼び出しはすべて RequestScheduler（utils.sheet_scheduler）を通す。
+呼び出しが 404 になったら（スプレッドシートの削除・差し替え）ハンドルと
+解決済みのIDを捨て、次のアクセスで名前から開き直す。
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+
+import gspread
+import streamlit as st
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from utils.sheet_scheduler import (
+    DEFAULT_READS_PER_MINUTE,
+    DEFAULT_WRITES_PER_MINUTE,
+    RequestScheduler,
+    ScheduledWorksheet,
+)
+
+# トークンの有効期限がこれより近づいたら先回りして更新する
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class SheetConnection:
+    """認証済み gspread クライアントとワークシートハンドルを保持する"""
+
+    def __init__(self, token_info, scheduler=None):
+        self._lock = threading.RLock()
+        self.scheduler = scheduler or RequestScheduler()
+        self._creds = Credentials.from_authorized_user_info(token_info)
+        self._refresh_request = Request()
+        # トークンは最初の API 呼び出しで更新する（Sheets が落ちていても作れるように）
+        self._client = gspread.authorize(self._creds)
+        self._worksheets = {}
+        self._keys = {}
+        # 404 になったID（secrets のIDヒントでも使わない）
+        self._stale_keys = set()
+
+    # ============================================
+    # 🔑 トークン管理
+    # ============================================
+    def _needs_refresh(self):
+        creds = self._creds
+        if not creds.token:
+            return True
+        if creds.expiry is None:
+            return False
+        # google-auth の expiry は naive UTC
+        return creds.expiry - datetime.utcnow() <= REFRESH_MARGIN
+
+    def _refresh_if_needed(self):
+        if not self._needs_refresh():
+            return
+        with self._lock:
+            if self._needs_refresh():
+                self._creds.refresh(self._refresh_request)
+
+    def client(self):
+        self._refresh_if_needed()
+        return self._client
+
+    # ============================================
+    # 📄 スプレッドシート / ワークシート
+    # ============================================
+    def _open_spreadsheet(self, sheet_name, key_hint=None):
+        gc = self.client()
+        key = self._keys.get(sheet_name) or key_hint
+        if key and key not in self._stale_keys:
+            try:
+                sh = self.scheduler.read(lambda: gc.open_by_key(key))
+                # 削除・差し替え・改名されていれば名前から解決し直す
+                if sh.title == sheet_name:
+                    self._keys[sheet_name] = key
+                    return sh
+            except gspread.exceptions.SpreadsheetNotFound:
+                pass
+            self._keys.pop(sheet_name, None)
+
+        sh = self.scheduler.read(lambda: gc.open(sheet_name))
+        self._keys[sheet_name] = sh.id
+        return sh
+
+    def worksheet(self, sheet_name, key_hint=None):
+        ws = self._worksheets.get(sheet_name)
+        if ws is None:
+            with self._lock:
+                ws = self._worksheets.get(sheet_name)
+                if ws is None:
+                    sh = self._open_spreadsheet(sheet_name, key_hint)
+                    ws = ScheduledWorksheet(
+                        self.scheduler.read(lambda: sh.sheet1), self.scheduler,
+                        on_not_found=lambda: self.invalidate(sheet_name),
+                    )
+                    self._worksheets[sheet_name] = ws
+        else:
+            self._refresh_if_needed()
+        return ws
+
+    def invalidate(self, sheet_name):
+        """ハンドルとIDを破棄し、次回アクセス時に名前から開き直す"""
+        with self._lock:
+            self._worksheets.pop(sheet_name, None)
+            key = self._keys.pop(sheet_name, None)
+            if key:
+                self._stale_keys.add(key)
+
+
+@st.cache_resource
+def get_connection():
+    scheduler = RequestScheduler(
+        reads_per_minute=int(st.secrets.get("SHEETS_READS_PER_MINUTE", DEFAULT_READS_PER_MINUTE)),
+        writes_per_minute=int(st.secrets.get("SHEETS_WRITES_PER_MINUTE", DEFAULT_WRITES_PER_MINUTE)),
+    )
+    return SheetConnection(json.loads(st.secrets["OAUTH_TOKEN"]), scheduler)
+
+
+def get_product_sheet():
+    return get_connection().worksheet(
+        st.secrets["PRODUCT_SHEET_NAME"], st.secrets.get("PRODUCT_SHEET_KEY")
+    )
+
@@ -0,0 +1,190 @@
+"""Google Sheets API 呼び出しのスケジューラ
+
+Sheets API には1分あたりの読み込み・書き込みクォータがあり、昼休みなど
+アクセスが集中すると 429 が返って「購入処理中にエラーが発生しました」
+になってしまう。全ての gspread 呼び出しをここに通し、
+
+- クォータに合わせたトークンバケットで送信ペースを揃える
+- 429 / 5xx はジッター付き指数バックオフで再試行する
+- 同じキーを付けた読み込み（Drive の最終更新日時など）が同時に走って
+  いれば1回の結果を共有する
+
+ことで、ピーク時はエラーではなく「少し遅くなる」だけにする。
+
+ワークシートのデータの読み込みはここでは共有しない。実行中の古い取得に
+相乗りすると、その取得より後に行った書き込みが反映されていない結果を
+「今読んだもの」として受け取ってしまうため。全件取得の重複は
+SnapshotCache が開始時刻を把握したうえでまとめている。
+"""
+import random
+import threading
+import time
+
+import gspread
+
+# Sheets API のユーザー単位クォータ（1分あたり）
+DEFAULT_READS_PER_MINUTE = 60
+DEFAULT_WRITES_PER_MINUTE = 60
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 5xx はサーバー側で処理済みのこともあるので、冪等でない書き込みは 429 だけ再試行する
+RATE_LIMIT_STATUS = {429}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+
+# 読み込み系 / 書き込み系の Worksheet メソッド
+READ_METHODS = {
+    "get_all_records", "get_all_values", "get_values", "get",
+    "batch_get", "cell", "acell", "row_values", "col_values",
+}
+WRITE_METHODS = {
+    "update", "update_cell", "update_acell", "batch_update",
+    "append_row", "append_rows",
+}
+# 2回実行すると結果が変わる（行が重複する）書き込み
+NON_IDEMPOTENT_METHODS = {"append_row", "append_rows"}
+
+
+class TokenBucket:
+    """1分あたり rate_per_minute 回まで通すトークンバケット"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、その結果を待って共有する"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+def _status_code(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+class RequestScheduler:
+    def __init__(self, reads_per_minute=DEFAULT_READS_PER_MINUTE,
+                 writes_per_minute=DEFAULT_WRITES_PER_MINUTE):
+        self._buckets = {
+            "read": TokenBucket(reads_per_minute),
+            "write": TokenBucket(writes_per_minute),
+        }
+        self._inflight = SingleFlight()
+
+    def _run(self, kind, fn, retry_status=RETRY_STATUS):
+        bucket = self._buckets[kind]
+        for attempt in range(MAX_RETRIES + 1):
+            bucket.acquire()
+            try:
+                return fn()
+            except gspread.exceptions.APIError as e:
+                if _status_code(e) not in retry_status or attempt == MAX_RETRIES:
+                    raise
+            # フルジッター付き指数バックオフ
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+    def read(self, fn, key=None):
+        """読み込み。key が同じ呼び出しが実行中ならその結果を共有する"""
+        if key is None:
+            return self._run("read", fn)
+        return self._inflight.do(key, lambda: self._run("read", fn))
+
+    def write(self, fn, idempotent=True):
+        """書き込み。idempotent=False なら 429（未処理が確実）のときだけ再試行する"""
+        return self._run("write", fn, RETRY_STATUS if idempotent else RATE_LIMIT_STATUS)
+
+
+def is_not_found(error):
+    """スプレッドシートが削除された・見えなくなったときのエラーか"""
+    return isinstance(error, gspread.exceptions.SpreadsheetNotFound) or (
+        isinstance(error, gspread.exceptions.APIError) and _status_code(error) == 404
+    )
+
+
+class ScheduledWorksheet:
+    """gspread.Worksheet のラッパー。API 呼び出しをスケジューラ経由にする
+
+    on_not_found は呼び出しが 404 になったときに呼ばれる（ハンドルの破棄用）。
+    """
+
+    def __init__(self, worksheet, scheduler, on_not_found=None):
+        self._ws = worksheet
+        self._scheduler = scheduler
+        self._on_not_found = on_not_found
+
+    def _call(self, run):
+        try:
+            return run()
+        except Exception as e:
+            if self._on_not_found is not None and is_not_found(e):
+                self._on_not_found()
+            raise
+
+    def __getattr__(self, name):
+        attr = getattr(self._ws, name)
+        if name in READ_METHODS:
+            def read(*args, **kwargs):
+                return self._call(lambda: self._scheduler.read(lambda: attr(*args, **kwargs)))
+            return read
+        if name in WRITE_METHODS:
+            def write(*args, **kwargs):
+                return self._call(lambda: self._scheduler.write(
+                    lambda: attr(*args, **kwargs), idempotent=name not in NON_IDEMPOTENT_METHODS,
+                ))
+            return write
+        return attr
+
+    def last_modified(self):
+        """スプレッドシートの Drive 上の最終更新日時（全件取得よりずっと軽い）"""
+        sh = self._ws.spreadsheet
+        return self._call(lambda: self._scheduler.read(sh.get_lastUpdateTime, key=(sh.id, "modifiedTime")))
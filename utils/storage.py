@@ -0,0 +1,326 @@
+"""商品・ユーザーの永続化バックエンド
+
+ページは get_storage() が返すバックエンドだけを通して読み書きする。
+
+- SheetsBackend（既定）: Google Sheets が正本。ProductCatalog / UserDirectory
+  （と、有効ならローカル SQLite 複製）を使う。defer=True の書き込みは
+  WriteBehindQueue に積み、まとめてシートに書く。
+- SqliteBackend: SQLite が正本。書き込みはトランザクションで行うので Sheets の
+  書き込みクォータに縛られない。事務局が見るシートへは一定間隔でまとめて
+  書き出す（シート側での手作業の編集は上書きされる）。
+
+secrets の STORAGE_BACKEND = "sqlite" と SQLITE_DB_PATH で切り替える。
+"""
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+import time
+
+import streamlit as st
+
+from utils.local_replica import SqliteProducts, create_product_schema, get_replica, sql_name
+from utils.product_catalog import COLUMNS, LAST_COLUMN, PURCHASE_COLUMNS, get_catalog
+from utils.sheet_client import get_connection
+from utils.user_directory import get_user_directory
+from utils.write_behind import DEFAULT_FLUSH_INTERVAL, WriteBehindQueue
+
+DEFAULT_EXPORT_INTERVAL = 60
+DEFAULT_JOURNAL_PATH = "write_behind_journal.jsonl"
+
+
+class StorageBackend(ABC):
+    """バックエンドの共通インターフェース"""
+
+    # ---- 商品（読み込み） ----
+    @abstractmethod
+    def records(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def listed_products(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find(self, product_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def by_buyer(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def by_seller(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_by_buyer_status(self, user_id, status):
+        raise NotImplementedError
+
+    @abstractmethod
+    def version(self):
+        """商品データの版。変わっていなければ前回読んだ内容のまま"""
+        raise NotImplementedError
+
+    # ---- 商品（書き込み） ----
+    @abstractmethod
+    def append_product(self, values):
+        """A〜P 列の値で商品を追加する"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_product(self, product_id, values, defer=False):
+        """A〜P 列の値で商品を上書きする。商品が無ければ False
+
+        購入者〜ステータス（M〜P 列）は transition() だけが変えるので、
+        values のその列は無視する。defer=True なら急がない書き込みとして
+        後でまとめて書いてよい。
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def transition(self, product_id, from_status, to_status, fields=None, defer=False):
+        """ステータスが from_status のままなら to_status に変える
+
+        成功なら True、ステータスが既に変わっていれば False、商品が無ければ None。
+        defer=True（取下げ・再出品など）は後でまとめて書いてよい。
+        """
+        raise NotImplementedError
+
+    # ---- ユーザー ----
+    @abstractmethod
+    def user_records(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_user(self, user_id):
+        raise NotImplementedError
+
+
+class SheetsBackend(StorageBackend):
+    def __init__(self, catalog, users, replica=None, write_behind=None):
+        self._catalog = catalog
+        self._users = users
+        self._replica = replica
+        self._write_behind = write_behind
+
+    def _products(self):
+        # 複製にデータがあれば読み込みはそちらから
+        if self._replica is not None and self._replica.ready():
+            return self._replica.products
+        return self._catalog
+
+    def _user_reader(self):
+        if self._replica is not None and self._replica.ready():
+            return self._replica.users
+        return self._users
+
+    def records(self):
+        return self._products().records()
+
+    def listed_products(self):
+        return self._products().listed_products()
+
+    def find(self, product_id):
+        # 購入・支払い前の最新化に使うので、正本側のキャッシュから引く
+        return self._catalog.find(product_id)
+
+    def by_buyer(self, user_id):
+        return self._products().by_buyer(user_id)
+
+    def by_seller(self, user_id):
+        return self._products().by_seller(user_id)
+
+    def count_by_buyer_status(self, user_id, status):
+        return self._products().count_by_buyer_status(user_id, status)
+
+    def version(self):
+        if self._replica is not None and self._replica.ready():
+            return "replica", self._replica.version()
+        return "catalog", self._catalog.version()
+
+    def append_product(self, values):
+        self._catalog.append_row(values)
+
+    def update_product(self, product_id, values, defer=False):
+        # 購入者〜ステータスは購入と競合するので書かない
+        fields = {
+            c: v for c, v in zip(COLUMNS, values)
+            if c != "商品ID" and c not in PURCHASE_COLUMNS
+        }
+        if defer and self._write_behind is not None:
+            if self._catalog.find(product_id) is None:
+                return False
+            self._write_behind.submit(product_id, fields)
+            return True
+        row_num = self._catalog.row_number(product_id)
+        if row_num is None:
+            return False
+        self._catalog.update_fields(row_num, fields)
+        return True
+
+    def transition(self, product_id, from_status, to_status, fields=None, defer=False):
+        if defer and fields is None and self._write_behind is not None:
+            return self._write_behind.transition(product_id, from_status, to_status)
+        return self._catalog.transition(product_id, from_status, to_status, fields)
+
+    def user_records(self):
+        return self._user_reader().records()
+
+    def find_user(self, user_id):
+        return self._user_reader().find(user_id)
+
+
+class SqliteBackend(StorageBackend):
+    def __init__(self, path, users):
+        self._users = users
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            create_product_schema(self._conn)
+        self._products = SqliteProducts(self)
+        self._changes = 0
+        self._exported = 0
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(sql, params)
+            self._changes += 1
+            return cursor.rowcount
+
+    # ============================================
+    # 📄 読み込み
+    # ============================================
+    def records(self):
+        return self._products.records()
+
+    def listed_products(self):
+        return self._products.listed_products()
+
+    def find(self, product_id):
+        return self._products.find(product_id)
+
+    def by_buyer(self, user_id):
+        return self._products.by_buyer(user_id)
+
+    def by_seller(self, user_id):
+        return self._products.by_seller(user_id)
+
+    def count_by_buyer_status(self, user_id, status):
+        return self._products.count_by_buyer_status(user_id, status)
+
+    def version(self):
+        with self._lock:
+            return self._changes
+
+    def user_records(self):
+        return self._users.records()
+
+    def find_user(self, user_id):
+        return self._users.find(user_id)
+
+    # ============================================
+    # ✏ 書き込み（トランザクション）
+    # ============================================
+    def append_product(self, values):
+        self._execute(
+            f"INSERT INTO products (row_num, {', '.join(sql_name(c) for c in COLUMNS)}) "
+            f"VALUES ((SELECT COALESCE(MAX(row_num), 1) + 1 FROM products), "
+            f"{', '.join('?' * len(COLUMNS))})",
+            list(values),
+        )
+
+    def update_product(self, product_id, values, defer=False):
+        # SQLite への書き込みは速いので defer は無視する
+        fields = {
+            c: v for c, v in zip(COLUMNS, values)
+            if c != "商品ID" and c not in PURCHASE_COLUMNS
+        }
+        return self._execute(
+            f"UPDATE products SET {', '.join(sql_name(c) + ' = ?' for c in fields)} "
+            f"WHERE {sql_name('商品ID')} = ?",
+            list(fields.values()) + [str(product_id)],
+        ) > 0
+
+    def transition(self, product_id, from_status, to_status, fields=None, defer=False):
+        fields = {**(fields or {}), "ステータス": to_status}
+        # 条件付き UPDATE 1文なので、同時に実行されても1件しか成功しない
+        updated = self._execute(
+            f"UPDATE products SET {', '.join(sql_name(c) + ' = ?' for c in fields)} "
+            f"WHERE {sql_name('商品ID')} = ? AND {sql_name('ステータス')} = ?",
+            list(fields.values()) + [str(product_id), from_status],
+        )
+        if updated:
+            return True
+        return False if self.find(product_id) is not None else None
+
+    # ============================================
+    # 🔄 シートとの受け渡し
+    # ============================================
+    def import_if_empty(self, records):
+        """初回だけ、シートの内容を取り込む"""
+        if self.query("SELECT 1 FROM products LIMIT 1"):
+            return
+        rows = records()
+        placeholders = ", ".join("?" * (len(COLUMNS) + 1))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO products VALUES ({placeholders})",
+                [[i + 2] + [row.get(c, "") for c in COLUMNS] for i, row in enumerate(rows)],
+            )
+
+    def export(self, sheet):
+        """変更があれば全商品をシートの A2:P にまとめて書き出す（1リクエスト）"""
+        with self._lock:
+            changes = self._changes
+        if changes == self._exported:
+            return
+        rows = self._products.records()
+        if rows:
+            sheet.update(
+                range_name=f"A2:{LAST_COLUMN}{len(rows) + 1}",
+                values=[[row.get(c, "") for c in COLUMNS] for row in rows],
+            )
+        self._exported = changes
+
+    def start_export(self, sheet, interval=DEFAULT_EXPORT_INTERVAL):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(sheet())
+                except Exception:
+                    # 次の周期で再試行する
+                    pass
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+@st.cache_resource
+def get_storage():
+    if st.secrets.get("STORAGE_BACKEND", "sheets") == "sqlite":
+        catalog = get_catalog()
+        backend = SqliteBackend(st.secrets["SQLITE_DB_PATH"], get_user_directory())
+        backend.import_if_empty(catalog.records)
+
+        connection = get_connection()
+        name = st.secrets["PRODUCT_SHEET_NAME"]
+        key = st.secrets.get("PRODUCT_SHEET_KEY")
+        backend.start_export(
+            lambda: connection.worksheet(name, key),
+            interval=float(st.secrets.get("SHEET_EXPORT_INTERVAL", DEFAULT_EXPORT_INTERVAL)),
+        )
+        return backend
+    catalog = get_catalog()
+    write_behind = WriteBehindQueue(
+        catalog,
+        st.secrets.get("WRITE_BEHIND_JOURNAL", DEFAULT_JOURNAL_PATH),
+        interval=float(st.secrets.get("WRITE_BEHIND_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+    )
+    write_behind.start()
+    return SheetsBackend(catalog, get_user_directory(), get_replica(), write_behind)
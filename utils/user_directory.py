@@ -0,0 +1,42 @@
+"""ユーザー管理シートのキャッシュ
+
+ログイン・支払いメール・マイページ・ダッシュボードで使うユーザー一覧を
+全セッションで共有する。取得は SnapshotCache 経由なので、同時アクセス時も
+シートの取得は1回にまとまる。
+"""
+import streamlit as st
+
+from utils.sheet_cache import SnapshotCache
+from utils.sheet_client import get_connection
+
+DEFAULT_TTL = 30
+
+
+class UserDirectory:
+    def __init__(self, sheet, ttl=DEFAULT_TTL):
+        self._sheet = sheet
+        self._cache = SnapshotCache(
+            self._load, ttl, version=lambda: self._sheet().last_modified()
+        )
+
+    def _load(self, previous=None):
+        records = self._sheet().get_all_records()
+        by_id = {str(row.get("id", "")).strip(): row for row in records}
+        return records, by_id
+
+    def records(self):
+        return list(self._cache.get()[0])
+
+    def find(self, user_id):
+        return self._cache.get()[1].get(str(user_id).strip())
+
+
+@st.cache_resource
+def get_user_directory():
+    connection = get_connection()
+    name = st.secrets["USER_SHEET_NAME"]
+    key = st.secrets.get("USER_SHEET_KEY")
+    return UserDirectory(
+        lambda: connection.worksheet(name, key),
+        ttl=float(st.secrets.get("USER_CACHE_TTL", DEFAULT_TTL)),
+    )
@@ -0,0 +1,102 @@
+"""急がない書き込みの後書き（write-behind）キュー
+
+取下げ・再出品・出品内容の修正は、他の人の購入と競合しないので1件ずつ
+すぐシートに書く必要がない。WriteBehindQueue はこれらをカタログに
+保留として積み（画面とキャッシュには即座に反映される）、裏のスレッドが
+一定間隔で1回の batch_update にまとめてシートに書く。
+
+保留中の変更はジャーナル（1行1件の JSON）に fsync して追記するので、
+書き出す前にプロセスが落ちても次の起動時に読み直して書き出せる。
+購入・支払いはこれまでどおり transition() で即座にシートに書く。
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+
+class WriteBehindQueue:
+    def __init__(self, catalog, journal_path, interval=DEFAULT_FLUSH_INTERVAL):
+        self._catalog = catalog
+        self._path = journal_path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._replay()
+
+    # ============================================
+    # 📓 ジャーナル
+    # ============================================
+    def _replay(self):
+        """前回書き出せなかった変更を保留に戻す"""
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で落ちた最終行は捨てる
+                    continue
+                self._catalog.stage(entry["id"], entry["fields"], entry.get("from"))
+
+    def _line(self, product_id, fields, from_status=None):
+        entry = {"id": str(product_id), "fields": fields}
+        if from_status is not None:
+            entry["from"] = from_status
+        return json.dumps(entry, ensure_ascii=False)
+
+    def _append(self, product_id, fields, from_status=None):
+        line = self._line(product_id, fields, from_status)
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _rewrite(self):
+        """まだ書き出していない分だけを残してジャーナルを作り直す"""
+        with self._lock:
+            pending = self._catalog.pending_changes()
+            expected = self._catalog.expected_statuses()
+            tmp = self._path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for product_id, fields in pending.items():
+                    f.write(self._line(product_id, fields, expected.get(product_id)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path)
+
+    # ============================================
+    # ✏ 書き込み
+    # ============================================
+    def submit(self, product_id, fields):
+        """fields（{列名: 値}）を保留にする。シートへは次の flush で書かれる"""
+        self._catalog.stage(product_id, fields)
+        self._append(product_id, fields)
+
+    def transition(self, product_id, from_status, to_status):
+        """キャッシュ上のステータスで遷移を判定し、書き込みは保留にする"""
+        result = self._catalog.transition_local(product_id, from_status, to_status)
+        if result:
+            self._append(product_id, {"ステータス": to_status}, from_status)
+        return result
+
+    def flush(self):
+        if not self._catalog.pending_changes():
+            return
+        self._catalog.flush_pending()
+        self._rewrite()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # 書けなかった分は保留のまま次の周期で再試行する
+                pass
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()